@@ -9,18 +9,29 @@ $Id: conference.py,v 1.25 2014/05/24 23:42:19 wesc Exp wesc $
 created by wesc on 2014 apr 21
 
 """
+import collections
 from datetime import datetime
+import hashlib
+import json
+import logging
+import random
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from google.appengine.api import app_identity
+from google.appengine.api import datastore_errors
+from google.appengine.api import mail
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
 from models import ConflictException
+from models import Announcement
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
@@ -29,19 +40,37 @@ from models import BooleanMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
+from models import ConferenceImportForm
+from models import ConferenceImportResult
+from models import ConferenceImportResults
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceSummary
+from models import ConferenceSummaryForm
+from models import ConferenceSummaryForms
+from models import RegistrationRequest
+from models import SeatShard
+from models import AgendaSnapshot
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import Speaker
+from models import FeaturedSpeaker
 from models import TeeShirtSize
+from models import WishlistUpdateForm
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
+from settings import CONFIRMATION_EMAIL_RATE
+
+from conference_index import ConferenceIndex
+from query_planner import QueryPlanner
+from tiered_cache import TieredCache
 
 from utils import getUserId
+from utils import LRUCache
 
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
@@ -49,10 +78,66 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_SPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_SPEAKER_PREFIX = "FEATURED_SPEAKER:"
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
 SPEAKER_TPL = ('Featured Speaker: %s in sessions:\n\n%s')
+NEARLY_SOLD_OUT_SEATS = 5
+SPEAKER_WINDOW = 10     # seconds between Featured Speaker refreshes
+
+# announcement and featured speakers are read on every home page load;
+# refreshes and invalidations happen when they change
+HOME_PAGE_CACHE = TieredCache('HOME_PAGE:', fresh_ttl=5 * 60,
+                              stale_ttl=60 * 60)
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MEMCACHE_ORGANIZER_PREFIX = "ORGANIZER_NAME:"
+MEMCACHE_ORGANIZER_TTL = 24 * 60 * 60
+
+# organiser displayName by organizerUserId; short ttl bounds how long an
+# instance can serve a name that was changed on another instance
+ORGANIZER_NAMES = LRUCache(1000, ttl=60)
+ORGANIZER_NAME_BATCH_SIZE = 100
+
+# conferences at least this big spread their seats over SEAT_SHARDS
+# SeatShard entities so registrations do not contend on one entity group
+SHARDED_SEATS_MIN_ATTENDEES = 1000
+SEAT_SHARDS = 20
+SEAT_SHARD_ATTEMPTS = 3
+SEAT_SYNC_WINDOW = 10   # seconds between seatsAvailable refreshes
+MEMCACHE_CONF_GENERATION_KEY = "CONFERENCE_GENERATION"
+MEMCACHE_CONF_QUERY_PREFIX = "CONFERENCE_QUERY:"
+MEMCACHE_CONF_QUERY_TTL = 10 * 60
+MEMCACHE_WISHLIST_PREFIX = "WISHLIST_SESSIONS:"
+MEMCACHE_WISHLIST_TTL = 60 * 60
+MEMCACHE_WISHLIST_VERSION_PREFIX = "WISHLIST_VERSION:"
+
+# conferences at least this big take registrations through a pull queue
+# that is applied in batches by /crons/process_registrations
+QUEUED_REGISTRATION_MIN_ATTENDEES = 10000
+REGISTRATION_QUEUE = 'registrations'
+REGISTRATION_LEASE_SECONDS = 60
+REGISTRATION_LEASE_SIZE = 100
+REGISTRATION_TXN_SIZE = 24   # profiles per XG transaction (+ conference)
+REGISTRATION_PENDING = 'PENDING'
+REGISTRATION_REGISTERED = 'REGISTERED'
+REGISTRATION_UNREGISTERED = 'UNREGISTERED'
+REGISTRATION_REJECTED = 'REJECTED'
+REGISTRATION_NONE = 'NOT_REGISTERED'
+REGISTRATION_MAX_ATTEMPTS = 5
+MEMCACHE_REGISTRATION_ATTEMPTS_PREFIX = "REGISTRATION_ATTEMPTS:"
+
+IMPORT_MAX_ITEMS = 1000
+IMPORT_PUT_SIZE = 100   # conferences per put_multi
+
+CONFIRMATION_EMAIL_QUEUE = 'confirmation-emails'
+CONFIRMATION_EMAIL_LEASE_SECONDS = 60
+CONFIRMATION_EMAIL_LEASE_SIZE = 100
+CONFIRMATION_EMAIL_MAX_ATTEMPTS = 5
+CONFIRMATION_EMAIL_BACKOFF = 60     # seconds; doubles on each retry
+CONFIRMATION_EMAIL_SUBJECT = 'You created a new Conference!'
+CONFIRMATION_EMAIL_TPL = ('Hi, you have created a following '
+                          'conference:\r\n\r\n%s')
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -80,6 +165,10 @@ FIELDS = {
     'MAX_ATTENDEES': 'maxAttendees',
 }
 
+# queries with inequalities on several fields are answered from an
+# in-process index of the small Conference fields
+CONFERENCE_INDEX = ConferenceIndex()
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -104,6 +193,13 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    speaker=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    cursor=messages.StringField(3),
+)
+
 WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1),
@@ -112,6 +208,14 @@ WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
 CONFERENCE = "Conference"
 SESSION = "Session"
 
+SPEAKER_BATCH_SIZE = 100
+
+# datastore queries use the best composite index in index.yaml and
+# filter whatever it does not cover in memory, scanning at most
+# MAX_POST_FILTER_SCAN entities per page
+CONFERENCE_PLANNER = QueryPlanner(CONFERENCE, 'name')
+MAX_POST_FILTER_SCAN = 1000
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -127,6 +231,15 @@ SESSION = "Session"
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+    def __init__(self):
+        # a service instance serves a single request, so the profile
+        # loaded by _getProfileFromUser is cached here as a unit of work:
+        # changes are recorded in _profileDirty and written by one put
+        # in _flushProfile
+        super(ConferenceApi, self).__init__()
+        self._profile = None
+        self._profileDirty = set()
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
     def _copyConferenceToForm(self, conf, displayName):
@@ -146,16 +259,150 @@ class ConferenceApi(remote.Service):
         cf.check_initialized()
         return cf
 
-    def _createConferenceObject(self, request):
+    @staticmethod
+    def _getOrganizerNames(conferences):
+        """Return dict of organizerUserId -> displayName for conferences.
+
+        Conferences that already store organizerDisplayName are skipped.
         """
-        Create or update Conference object, returning ConferenceForm/request.
+        return ConferenceApi._getOrganizerNamesAsync([
+            conf.organizerUserId for conf in conferences
+            if not conf.organizerDisplayName
+        ]).get_result()
+
+    @staticmethod
+    @ndb.tasklet
+    def _getOrganizerNamesAsync(user_ids):
+        """Resolve organiser display names through the name cache.
+
+        Lookups go to the in-process LRU first, then memcache, and only
+        the remaining misses are read from their Profile entities.
         """
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        ctx = ndb.get_context()
+        names = {}
+        missing = []
+        for user_id in set(user_ids):
+            name = ORGANIZER_NAMES.get(user_id)
+            if name is None:
+                missing.append(user_id)
+            else:
+                names[user_id] = name
+
+        if missing:
+            cached = yield [
+                ctx.memcache_get(MEMCACHE_ORGANIZER_PREFIX + user_id)
+                for user_id in missing
+            ]
+            misses = []
+            for user_id, name in zip(missing, cached):
+                if name is None:
+                    misses.append(user_id)
+                else:
+                    ORGANIZER_NAMES.set(user_id, name)
+                    names[user_id] = name
+
+            if misses:
+                profiles = yield ndb.get_multi_async(
+                    [ndb.Key(Profile, user_id) for user_id in misses]
+                )
+                for user_id, profile in zip(misses, profiles):
+                    # cache '' for missing names so they are not refetched
+                    name = getattr(profile, 'displayName', None) or ''
+                    ORGANIZER_NAMES.set(user_id, name)
+                    names[user_id] = name
+                yield [
+                    ctx.memcache_set(
+                        MEMCACHE_ORGANIZER_PREFIX + user_id, names[user_id],
+                        time=MEMCACHE_ORGANIZER_TTL
+                    ) for user_id in misses
+                ]
+        raise ndb.Return(names)
 
+    @staticmethod
+    def _invalidateOrganizerName(user_id):
+        """Drop a cached organiser displayName after it has changed."""
+        ORGANIZER_NAMES.delete(user_id)
+        memcache.delete(MEMCACHE_ORGANIZER_PREFIX + user_id)
+
+    @staticmethod
+    @ndb.transactional_tasklet
+    def _setOrganizerNamesAsync(c_keys, name, overwrite=True):
+        """Store name as organizerDisplayName of one organiser's conferences.
+
+        The conferences share their organiser's entity group, so they are
+        updated together in a single transaction rather than in
+        concurrent ones that would contend with each other.
+        """
+        confs = yield ndb.get_multi_async(c_keys)
+        changed = [
+            conf for conf in confs
+            if conf and conf.organizerDisplayName != name
+            and (overwrite or not conf.organizerDisplayName)
+        ]
+        if not changed:
+            return
+        for conf in changed:
+            conf.organizerDisplayName = name
+        yield ndb.put_multi_async(changed + [
+            ConferenceSummary.fromConference(conf) for conf in changed])
+
+    @staticmethod
+    def _updateOrganizerName(user_id, cursor=None):
+        """Copy a profile's displayName onto one batch of its conferences.
+
+        Used by the fan-out task queued when a user changes their name;
+        returns the urlsafe cursor of the next batch, or None when done.
+        """
+        p_key = ndb.Key(Profile, user_id)
+        name = getattr(p_key.get(), 'displayName', None)
+        c_keys, next_cursor, more = Conference.query(
+            ancestor=p_key
+        ).fetch_page(
+            ORGANIZER_NAME_BATCH_SIZE, keys_only=True,
+            start_cursor=ndb.Cursor(urlsafe=cursor) if cursor else None
+        )
+        if c_keys:
+            # failures propagate so the task is retried
+            ConferenceApi._setOrganizerNamesAsync(c_keys, name).get_result()
+            ConferenceApi._bumpConferenceGeneration()
+        return next_cursor.urlsafe() if more else None
+
+    @staticmethod
+    def _backfillOrganizerNames(cursor=None):
+        """Store organizerDisplayName on one batch of older conferences.
+
+        Conferences that already have a name are left untouched; returns
+        the urlsafe cursor of the next batch, or None when done.
+        """
+        c_keys, next_cursor, more = Conference.query().fetch_page(
+            ORGANIZER_NAME_BATCH_SIZE, keys_only=True,
+            start_cursor=ndb.Cursor(urlsafe=cursor) if cursor else None
+        )
+        names = ConferenceApi._getOrganizerNamesAsync(
+            [c_key.parent().id() for c_key in c_keys]
+        ).get_result()
+        # one transaction per organiser; different organisers' entity
+        # groups can be written concurrently
+        groups = collections.OrderedDict()
+        for c_key in c_keys:
+            groups.setdefault(c_key.root(), []).append(c_key)
+        futures = [
+            ConferenceApi._setOrganizerNamesAsync(
+                keys, names.get(root.id()) or None, overwrite=False
+            ) for root, keys in groups.items()
+        ]
+        ndb.Future.wait_all(futures)
+        for future in futures:
+            future.check_success()
+        return next_cursor.urlsafe() if more else None
+
+    def _newConference(self, request, c_key, organizer_name):
+        """Return the unsaved entities of a new conference.
+
+        The Conference comes first, followed by its summary and any seat
+        shards. request is filled in with the defaults and organiser
+        fields, ready to be returned.
+        """
         if not request.name:
             raise endpoints.BadRequestException(
                 "Conference 'name' field required"
@@ -167,7 +414,6 @@ class ConferenceApi(remote.Service):
                 getattr(request, field.name) for field in request.all_fields()
         }
         del data['websafeKey']
-        del data['organizerDisplayName']
 
         # add default values for those missing
         # (both data model & outbound Message)
@@ -193,26 +439,156 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        data['key'] = c_key
+        data['organizerUserId'] = request.organizerUserId = (
+            c_key.parent().id())
+        # store the organiser's name so listings need no profile lookup
+        data['organizerDisplayName'] = request.organizerDisplayName = (
+            organizer_name)
+
+        # the largest conferences queue their registrations; large ones
+        # get their seats split across shards
+        shards = []
+        if data['maxAttendees'] >= QUEUED_REGISTRATION_MIN_ATTENDEES:
+            data['queuedRegistration'] = True
+        elif data['maxAttendees'] >= SHARDED_SEATS_MIN_ATTENDEES:
+            data['seatShards'] = SEAT_SHARDS
+            shards = self._createSeatShards(
+                c_key, data['seatsAvailable'], SEAT_SHARDS)
+
+        conf = Conference(**data)
+        return [conf, ConferenceSummary.fromConference(conf)] + shards
+
+    def _createConferenceObject(self, request):
+        """
+        Create or update Conference object, returning ConferenceForm/request.
+        """
+        # preload necessary data items
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
         c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
         c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
-        data['organizerUserId'] = request.organizerUserId = user_id
+        entities = self._newConference(
+            request, c_key,
+            self._getOrganizerNamesAsync([user_id]).get_result()[user_id]
+            or None
+        )
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(
-            params={
-                'email': user.email(),
-                'conferenceInfo': repr(request)
-            },
-            url='/tasks/send_confirmation_email'
-        )
+        ndb.put_multi(entities)
+        self._bumpConferenceGeneration()
+        if self._isNearlySoldOut(entities[0].seatsAvailable):
+            self._refreshNearlySoldOut(c_key)
+        self._queueConfirmationEmails(user.email(), [c_key])
         return request
 
+    @staticmethod
+    def _importForms(request):
+        """Return (ConferenceForm or error string) per imported item."""
+        forms = list(request.items)
+        for line in (request.jsonl or '').splitlines():
+            if not line.strip():
+                continue
+            try:
+                forms.append(protojson.decode_message(ConferenceForm, line))
+            except (messages.Error, ValueError) as e:
+                forms.append('Invalid ConferenceForm: %s' % e)
+        if len(forms) > IMPORT_MAX_ITEMS:
+            raise endpoints.BadRequestException(
+                "At most %d conferences can be imported at once."
+                % IMPORT_MAX_ITEMS
+            )
+        return forms
+
+    @staticmethod
+    def _putImportedConference(result, entities):
+        """Write one imported conference atomically; report a failure.
+
+        A failed commit may still have been applied, so the error asks
+        the client to check the conference's websafeKey.
+        """
+        try:
+            ndb.transaction(lambda: ndb.put_multi(entities), xg=True)
+        except datastore_errors.Error as e:
+            result.error = 'Possibly not saved; check websafeKey: %s' % e
+            return False
+        return True
+
+    @endpoints.method(
+        ConferenceImportForm,
+        ConferenceImportResults,
+        path='conferences/import',
+        http_method='POST',
+        name='importConferences'
+    )
+    def importConferences(self, request):
+        """Create many conferences; report the outcome of each one.
+
+        Conferences come from items and from jsonl, one JSON
+        ConferenceForm per line. Items that fail are reported with an
+        error and do not stop the rest.
+        """
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        forms = self._importForms(request)
+        results = [ConferenceImportResult(index=i) for i in range(len(forms))]
+        if not forms:
+            return ConferenceImportResults(items=results)
+
+        # one id allocation covers every conference of this organiser
+        p_key = ndb.Key(Profile, user_id)
+        first, last = Conference.allocate_ids(size=len(forms), parent=p_key)
+        name = self._getOrganizerNamesAsync(
+            [user_id]).get_result()[user_id] or None
+
+        built = []
+        for result, form, c_id in zip(results, forms, range(first, last + 1)):
+            if not isinstance(form, ConferenceForm):
+                result.error = form
+                continue
+            try:
+                entities = self._newConference(
+                    form, ndb.Key(Conference, c_id, parent=p_key), name)
+            except (endpoints.BadRequestException, ValueError) as e:
+                result.error = str(e)
+                continue
+            built.append((result, entities))
+
+        created = []
+        for i in range(0, len(built), IMPORT_PUT_SIZE):
+            chunk = built[i:i + IMPORT_PUT_SIZE]
+            for result, entities in chunk:
+                result.websafeKey = entities[0].key.urlsafe()
+            try:
+                ndb.put_multi(
+                    [entity for _, entities in chunk for entity in entities])
+            except datastore_errors.Error:
+                # part of the chunk may be written; keys are allocated,
+                # so writing each conference again cannot duplicate it
+                chunk = [
+                    (result, entities) for result, entities in chunk
+                    if self._putImportedConference(result, entities)
+                ]
+            created.extend(entities[0] for _, entities in chunk)
+
+        if created:
+            self._bumpConferenceGeneration()
+            for conf in created:
+                if self._isNearlySoldOut(conf.seatsAvailable):
+                    self._refreshNearlySoldOut(conf.key)
+            self._queueConfirmationEmails(
+                user.email(), [conf.key for conf in created])
+        return ConferenceImportResults(items=results)
+
     @staticmethod
     def _checkEntityKey(wskey, kind):
 
@@ -236,6 +612,20 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 'Problem with provided key %s. %s' % (wskey, e))
 
+    @staticmethod
+    def _parseEntityKey(wskey, kind):
+        """Return the Key for wskey, checking its kind without a get."""
+        try:
+            key = ndb.Key(urlsafe=wskey)
+        except Exception as e:
+            raise endpoints.BadRequestException(
+                'Problem with provided key %s. %s' % (wskey, e))
+
+        if key.kind() != kind:
+            raise endpoints.BadRequestException(
+                'Provided key was for kind: %s' % key.kind())
+        return key
+
     @ndb.transactional()
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
@@ -262,6 +652,9 @@ class ConferenceApi(remote.Service):
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            # organiser name is maintained from the Profile, not the form
+            if field.name == 'organizerDisplayName':
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -272,9 +665,9 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        ndb.put_multi([conf, ConferenceSummary.fromConference(conf)])
+        names = self._getOrganizerNames([conf])
+        return self._copyConferenceToForm(conf, names.get(user_id))
 
     @endpoints.method(
         ConferenceForm,
@@ -294,7 +687,11 @@ class ConferenceApi(remote.Service):
     )
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        conf_form = self._updateConferenceObject(request)
+        self._bumpConferenceGeneration()
+        # seats or name may have changed
+        self._refreshNearlySoldOut(ndb.Key(urlsafe=conf_form.websafeKey))
+        return conf_form
 
     @endpoints.method(
         CONF_GET_REQUEST,
@@ -305,14 +702,29 @@ class ConferenceApi(remote.Service):
     )
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
+        return self._getConferenceAsync(
+            request.websafeConferenceKey).get_result()
+
+    @ndb.tasklet
+    def _getConferenceAsync(self, wsck):
+        """Fetch a conference and its organiser's name concurrently."""
+        c_key = self._parseEntityKey(wsck, CONFERENCE)
+
+        # the organiser is the conference's parent, so the name lookup
+        # can be issued without waiting on the conference get
+        organizer_id = c_key.parent().id()
+        conf, names = yield (
+            c_key.get_async(),
+            self._getOrganizerNamesAsync([organizer_id])
+        )
+        if not conf:
+            raise endpoints.NotFoundException(
+                'A %s with provided key was not found' % CONFERENCE)
 
-        wsck = request.websafeConferenceKey
-        # get Conference object from request
-        conf = self._checkEntityKey(wsck, CONFERENCE)
-
-        prof = conf.key.parent().get()
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        raise ndb.Return(
+            self._copyConferenceToForm(conf, names.get(organizer_id))
+        )
 
     @endpoints.method(
         message_types.VoidMessage,
@@ -328,24 +740,40 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
+        return self._getConferencesCreatedAsync(user_id).get_result()
+
+    @ndb.tasklet
+    def _getConferencesCreatedAsync(self, user_id):
+        """Run the ancestor query and the name lookup concurrently."""
+        p_key = ndb.Key(Profile, user_id)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
-        # return set of ConferenceForm objects per Conference
+        confs, names = yield (
+            Conference.query(ancestor=p_key).fetch_async(),
+            self._getOrganizerNamesAsync([user_id])
+        )
 
-        return ConferenceForms(
+        # return set of ConferenceForm objects per Conference
+        raise ndb.Return(ConferenceForms(
                 items=[
                     self._copyConferenceToForm(
-                        conf, getattr(prof, 'displayName')
+                        conf, names.get(user_id)
                     ) for conf in confs
                 ]
-            )
+            ))
+
+    def _getQuery(self, request, keys_only=False):
+        """Return one page of conferences matching the submitted filters.
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+        Returns a (conferences, next_cursor) tuple; next_cursor is None
+        when there are no more results. With keys_only, keys are
+        returned instead of entities.
+        """
         q = Conference.query()
         inequality_filter, filters = self._formatFilters(request.filters)
+        # push down what the available indexes can serve
+        filters, post_filters, inequality_filter = \
+            CONFERENCE_PLANNER.plan(filters)
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
@@ -355,21 +783,78 @@ class ConferenceApi(remote.Service):
             q = q.order(Conference.name)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(
                 filtr["field"],
                 filtr["operator"],
                 filtr["value"]
             )
             q = q.filter(formatted_query)
-        return q
+
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE
+            )
+        try:
+            cursor = ndb.Cursor(urlsafe=request.cursor) \
+                if request.cursor else None
+        except Exception:
+            raise endpoints.BadRequestException("Invalid cursor.")
+
+        if not post_filters:
+            conferences, next_cursor, more = q.fetch_page(
+                page_size, start_cursor=cursor, keys_only=keys_only
+            )
+            return conferences, (next_cursor if more else None)
+
+        # scan until the page is full, stopping after the last match so
+        # the cursor resumes right behind it
+        conferences = []
+        scanned = 0
+        it = q.iter(start_cursor=cursor, produce_cursors=True,
+                    batch_size=page_size * 2)
+        next_cursor = None
+        for conf in it:
+            scanned += 1
+            if CONFERENCE_INDEX.matches(conf, post_filters):
+                conferences.append(conf)
+            if len(conferences) == page_size or \
+                    scanned == MAX_POST_FILTER_SCAN:
+                next_cursor = it.cursor_after() if it.has_next() else None
+                break
+        CONFERENCE_PLANNER.recordSlowShape(
+            filters + post_filters, scanned)
+        if keys_only:
+            conferences = [conf.key for conf in conferences]
+        return conferences, next_cursor
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
-        formatted_filters = []
+        formatted_filters = self._parseFilters(filters)
         inequality_field = None
 
+        for filtr in formatted_filters:
+            # Every operation except "=" is an inequality
+            if filtr["operator"] != "=":
+                # check if inequality operation has been used in
+                # previous filters.
+                # disallow the filter if inequality was performed on
+                # a different field before
+                # track the field on which the inequality operation
+                # is performed
+                if inequality_field and inequality_field != filtr["field"]:
+                    raise endpoints.BadRequestException(
+                        "Inequality filter is allowed on only one field."
+                    )
+                else:
+                    inequality_field = filtr["field"]
+
+        return (inequality_field, formatted_filters)
+
+    def _parseFilters(self, filters):
+        """Parse and format user supplied filters, with no query limits."""
+        formatted_filters = []
+
         for f in filters:
             filtr = {
                 field.name:
@@ -384,54 +869,256 @@ class ConferenceApi(remote.Service):
                     "Filter contains invalid field or operator."
                 )
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in
-                # previous filters.
-                # disallow the filter if inequality was performed on
-                # a different field before
-                # track the field on which the inequality operation
-                # is performed
-                if inequality_field and inequality_field != filtr["field"]:
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
                     raise endpoints.BadRequestException(
-                        "Inequality filter is allowed on only one field."
+                        "Filter value for %s must be a number."
+                        % filtr["field"]
                     )
-                else:
-                    inequality_field = filtr["field"]
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                       path='queryConferences',
                       http_method='POST',
                       name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time."""
+        # popular filter combinations are served from memcache
+        cache_key = self._queryCacheKey(request)
+        cached = memcache.get(cache_key)
+        if cached is not None:
+            return protojson.decode_message(ConferenceForms, cached)
+
+        filters = self._parseFilters(request.filters)
+        inequality_fields = set(
+            f["field"] for f in filters if f["operator"] != "=")
+        if len(inequality_fields) > 1:
+            # the datastore allows inequalities on one field only
+            conferences, next_cursor = self._searchIndex(request, filters)
+        else:
+            # the page is materialised once by _getQuery; both the
+            # organiser lookup and the form copy below read from that list
+            conferences, next_cursor = self._getQuery(request)
+            if next_cursor:
+                next_cursor = next_cursor.urlsafe()
+        names = self._getOrganizerNames(conferences)
+
+        # return individual ConferenceForm object per Conference
+        forms = ConferenceForms(
+                items=[self._copyConferenceToForm(
+                    conf, names.get(conf.organizerUserId)
+                ) for conf in conferences],
+                nextCursor=next_cursor
+        )
+        memcache.set(
+            cache_key, protojson.encode_message(forms),
+            time=MEMCACHE_CONF_QUERY_TTL)
+        return forms
+
+    @endpoints.method(ConferenceQueryForms, ConferenceSummaryForms,
+                      path='queryConferenceSummaries',
+                      http_method='POST',
+                      name='queryConferenceSummaries')
+    def queryConferenceSummaries(self, request):
+        """Query for conferences, returning slim list-view summaries."""
+        # cached like queryConferences pages, under their own keys
+        cache_key = self._queryCacheKey(request, 'summaries')
+        cached = memcache.get(cache_key)
+        if cached is not None:
+            return protojson.decode_message(ConferenceSummaryForms, cached)
+
+        filters = self._parseFilters(request.filters)
+        inequality_fields = set(
+            f["field"] for f in filters if f["operator"] != "=")
+        if len(inequality_fields) > 1:
+            # the index rechecks full Conferences; summarise those
+            # rather than reading the summaries as well
+            conferences, next_cursor = self._searchIndex(request, filters)
+            summaries = [
+                ConferenceSummary.fromConference(conf)
+                for conf in conferences
+            ]
+        else:
+            # keys-only query; the slim summaries are read by key
+            c_keys, next_cursor = self._getQuery(request, keys_only=True)
+            if next_cursor:
+                next_cursor = next_cursor.urlsafe()
+            summaries = self._getSummaries(c_keys)
+        forms = ConferenceSummaryForms(
+            items=[self._copySummaryToForm(summary) for summary in summaries],
+            nextCursor=next_cursor
+        )
+        memcache.set(
+            cache_key, protojson.encode_message(forms),
+            time=MEMCACHE_CONF_QUERY_TTL)
+        return forms
+
+    @endpoints.method(
+        message_types.VoidMessage,
+        ConferenceSummaryForms,
+        path='getConferenceSummariesCreated',
+        http_method='POST',
+        name='getConferenceSummariesCreated'
+    )
+    def getConferenceSummariesCreated(self, request):
+        """Return summaries of conferences created by user."""
+        # make sure user is authed
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        # keys-only ancestor query; the slim summaries are read by key
+        c_keys = Conference.query(
+            ancestor=ndb.Key(Profile, user_id)).fetch(keys_only=True)
+        return ConferenceSummaryForms(
+            items=[
+                self._copySummaryToForm(summary)
+                for summary in self._getSummaries(c_keys)
+            ]
+        )
+
+    @staticmethod
+    def _getSummaries(c_keys):
+        """Return the ConferenceSummary of each conference key, in order.
 
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [
-            (ndb.Key(Profile, conf.organizerUserId)) for conf in conferences
+        Summaries missing for older conferences are built from the
+        Conference and stored.
+        """
+        summaries = ndb.get_multi(
+            [ConferenceSummary.keyFor(c_key) for c_key in c_keys])
+        missing = [
+            c_key for c_key, summary in zip(c_keys, summaries)
+            if not summary
         ]
-        profiles = ndb.get_multi(organisers)
+        if missing:
+            built = dict(
+                (conf.key, ConferenceSummary.fromConference(conf))
+                for conf in ndb.get_multi(missing) if conf
+            )
+            for summary in built.values():
+                ConferenceApi._insertSummary(summary)
+            summaries = [
+                summary or built.get(c_key)
+                for c_key, summary in zip(c_keys, summaries)
+            ]
+        return [summary for summary in summaries if summary]
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+    @staticmethod
+    @ndb.transactional()
+    def _insertSummary(summary):
+        """Store summary unless one exists; that may hold newer data."""
+        if not summary.key.get():
+            summary.put()
+
+    def _copySummaryToForm(self, summary):
+        """Copy fields from ConferenceSummary to ConferenceSummaryForm."""
+        sf = ConferenceSummaryForm()
+        for field in sf.all_fields():
+            if hasattr(summary, field.name):
+                # convert Date to date string; just copy others
+                if field.name.endswith('Date'):
+                    setattr(sf, field.name,
+                            str(getattr(summary, field.name)))
+                else:
+                    setattr(sf, field.name, getattr(summary, field.name))
+        sf.websafeKey = summary.key.parent().urlsafe()
+        sf.check_initialized()
+        return sf
 
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(
-                    conf, names[conf.organizerUserId]
-                ) for conf in conferences]
+    @staticmethod
+    def _offsetPage(request):
+        """Return (pageSize, offset) of a request paged by offset cursor."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE
+            )
+        try:
+            offset = int(request.cursor or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid cursor.")
+        if offset < 0:
+            raise endpoints.BadRequestException("Invalid cursor.")
+        return page_size, offset
+
+    def _searchIndex(self, request, filters):
+        """Return one page of conferences from the in-process index.
+
+        Returns a (conferences, next_cursor) tuple, where the cursor is
+        the urlsafe offset of the next page, or None when there is none.
+        """
+        page_size, offset = self._offsetPage(request)
+        keys = CONFERENCE_INDEX.search(filters)
+        page = keys[offset:offset + page_size]
+        # the index may be a few minutes old; recheck the fresh entities
+        conferences = [
+            conf for conf in ndb.get_multi(page)
+            if conf and CONFERENCE_INDEX.matches(conf, filters)
+        ]
+        next_offset = offset + page_size
+        return conferences, (
+            str(next_offset) if next_offset < len(keys) else None)
+
+    def _queryCacheKey(self, request, view='forms'):
+        """Return the memcache key of a page of conference query results.
+
+        view tells apart the endpoints that answer the same query with
+        different messages. Filters are normalised by _parseFilters and
+        sorted, so requests that differ only in filter order share an
+        entry. The current conference generation is part of the key, so
+        bumping it retires every cached page at once.
+        """
+        filters = self._parseFilters(request.filters)
+        canonical = json.dumps([
+            view,
+            sorted(set(
+                (f["field"], f["operator"], f["value"]) for f in filters
+            )),
+            request.pageSize or DEFAULT_PAGE_SIZE,
+            request.cursor or '',
+        ])
+        return '%s%d:%s' % (
+            MEMCACHE_CONF_QUERY_PREFIX,
+            self._conferenceGeneration(),
+            hashlib.sha1(canonical).hexdigest()
         )
 
+    @staticmethod
+    def _generation(key):
+        """Return the generation counter stored in memcache under key."""
+        generation = memcache.get(key)
+        if generation is None:
+            # start from the clock so a memcache flush never brings back
+            # keys of an older generation
+            generation = int(time.time())
+            if not memcache.add(key, generation):
+                generation = memcache.get(key)
+        return generation or 0
+
+    @staticmethod
+    def _bumpGeneration(key):
+        """Retire every cache entry keyed by the generation under key."""
+        memcache.incr(key, initial_value=int(time.time()))
+
+    @staticmethod
+    def _conferenceGeneration():
+        """Return the current conference data generation."""
+        return ConferenceApi._generation(MEMCACHE_CONF_GENERATION_KEY)
+
+    @staticmethod
+    def _bumpConferenceGeneration():
+        """Invalidate cached query pages after conferences change."""
+        ConferenceApi._bumpGeneration(MEMCACHE_CONF_GENERATION_KEY)
+
 # - - - Session objects - - - - - - - - - - - - - - - - - - -
 
-    def _copySessionToForm(self, session):
+    @staticmethod
+    def _copySessionToForm(session):
         """Copy relevant fields from Session to SessionForm."""
         sf = SessionForm()
         for field in sf.all_fields():
@@ -446,6 +1133,129 @@ class ConferenceApi(remote.Service):
         sf.check_initialized()
         return sf
 
+    @staticmethod
+    def _fetchSessions(query):
+        """Run a Session query keys-only and resolve it with get_multi.
+
+        The query only returns keys; the entities come through ndb's
+        memcache-backed entity cache, so hot agendas are mostly served
+        from memcache.
+        """
+        sessions = ndb.get_multi(query.fetch(keys_only=True))
+        return [session for session in sessions if session]
+
+    def _getAgenda(self, wsck):
+        """Return the agenda snapshot of a conference, building if needed.
+
+        Snapshots are read by key (and so served from ndb's entity
+        cache); the conference itself is only checked on a miss.
+        """
+        c_key = self._parseEntityKey(wsck, CONFERENCE)
+        snapshot = AgendaSnapshot.keyFor(c_key).get()
+        if not snapshot:
+            conf = self._checkEntityKey(wsck, CONFERENCE)
+            try:
+                snapshot = self._buildAgenda(conf.key)
+            except datastore_errors.TransactionFailedError:
+                # sessions kept changing; answer without storing
+                snapshot = self._newAgenda(conf.key)
+        return snapshot.agenda
+
+    @staticmethod
+    @ndb.transactional()
+    def _buildAgenda(c_key):
+        """Build and store the agenda snapshot of a conference.
+
+        Sessions share the snapshot's entity group, so a session written
+        while the snapshot is built makes this transaction retry instead
+        of storing an agenda without it.
+        """
+        snapshot = ConferenceApi._newAgenda(c_key)
+        snapshot.put()
+        return snapshot
+
+    @staticmethod
+    def _newAgenda(c_key):
+        """Return an unsaved agenda snapshot of a conference.
+
+        The snapshot holds every SessionForm of the conference, encoded
+        as JSON, plus maps from type, date, speaker and highlight to
+        positions in that list.
+        """
+        sessions = ConferenceApi._fetchSessions(
+            Session.query(ancestor=c_key))
+        agenda = {
+            'sessions': [],
+            'byType': {},
+            'byDate': {},
+            'bySpeaker': {},
+            'byHighlight': {},
+        }
+        for i, session in enumerate(sessions):
+            agenda['sessions'].append(json.loads(protojson.encode_message(
+                ConferenceApi._copySessionToForm(session))))
+            agenda['byType'].setdefault(session.typeOfSession, []).append(i)
+            agenda['byDate'].setdefault(str(session.date), []).append(i)
+            agenda['bySpeaker'].setdefault(session.speaker, []).append(i)
+            for highlight in session.highlights:
+                agenda['byHighlight'].setdefault(highlight, []).append(i)
+
+        return AgendaSnapshot(key=AgendaSnapshot.keyFor(c_key), agenda=agenda)
+
+    @staticmethod
+    def _agendaForms(agenda, index=None, value=None):
+        """Return SessionForms for the whole agenda or one index entry."""
+        if index is None:
+            items = agenda['sessions']
+        else:
+            items = [
+                agenda['sessions'][i] for i in agenda[index].get(value, [])
+            ]
+        return protojson.decode_message(
+            SessionForms, json.dumps({'items': items}))
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _putSession(session):
+        """Put a session and add it to its speaker's index entry."""
+        session.put()
+        ConferenceApi._indexSpeakerSessions(session.speaker, [session.key])
+        ConferenceApi._tallySpeaker(session)
+
+    @staticmethod
+    @ndb.transactional()
+    def _indexSpeakerSessions(speaker, s_keys):
+        """Add session keys to the Speaker entry of speaker."""
+        if not Speaker.normalise(speaker):
+            return
+        sp_key = Speaker.keyFor(speaker)
+        entry = sp_key.get() or Speaker(key=sp_key, name=speaker)
+        known = set(entry.sessionKeys)
+        added = [s_key for s_key in s_keys if s_key not in known]
+        if added:
+            entry.sessionKeys.extend(added)
+            entry.put()
+
+    @staticmethod
+    def _backfillSpeakers(cursor=None):
+        """Index the speakers of one batch of older sessions.
+
+        Returns the urlsafe cursor of the next batch, or None when done.
+        """
+        s_keys, next_cursor, more = Session.query().fetch_page(
+            SPEAKER_BATCH_SIZE, keys_only=True,
+            start_cursor=ndb.Cursor(urlsafe=cursor) if cursor else None
+        )
+        by_speaker = {}
+        for session in ndb.get_multi(s_keys):
+            if session and Speaker.normalise(session.speaker):
+                by_speaker.setdefault(
+                    Speaker.normalise(session.speaker), (session.speaker, [])
+                )[1].append(session.key)
+        for speaker, keys in by_speaker.values():
+            ConferenceApi._indexSpeakerSessions(speaker, keys)
+        return next_cursor.urlsafe() if more else None
+
     def _createSessionObject(self, request):
         """Create or update Session object, returning SessionForm/request."""
         # preload necessary data items
@@ -473,7 +1283,6 @@ class ConferenceApi(remote.Service):
                 request, field.name
             ) for field in request.all_fields()
         }
-        websafeConferenceKey = data['websafeConferenceKey']
         del data['websafeConferenceKey']
         del data['websafeKey']
 
@@ -497,11 +1306,14 @@ class ConferenceApi(remote.Service):
         # create Session, add the set speaker task to the queue
         # creation of Session & return (modified) SessionForm
         session = Session(**data)
-        session.put()
+        self._putSession(session)
+
+        self._scheduleSpeakerRefresh(conf.key)
 
-        taskqueue.add(params={'speaker': data["speaker"],
-                              'websafeConferenceKey': websafeConferenceKey},
-                      url='/tasks/set_speaker')
+        # retire the agenda snapshot and rebuild it in the background
+        AgendaSnapshot.keyFor(conf.key).delete()
+        taskqueue.add(params={'websafeConferenceKey': conf.key.urlsafe()},
+                      url='/tasks/rebuild_agenda')
 
         return self._copySessionToForm(session)
 
@@ -525,15 +1337,9 @@ class ConferenceApi(remote.Service):
     )
     def getConferenceSessions(self, request):
         """Return conference sessions (by websafeConferenceKey)."""
-        # get Conference object from request
-        wsck = request.websafeConferenceKey
-        conf = self._checkEntityKey(wsck, CONFERENCE)
-        # get all Session objects with the conf ancestor
-        sessions = Session.query(ancestor=conf.key)
-        # return list of SessionForm objects
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        # return list of SessionForm objects from the agenda snapshot
+        agenda = self._getAgenda(request.websafeConferenceKey)
+        return self._agendaForms(agenda)
 
     @endpoints.method(
         SESSION_GET_REQUEST,
@@ -543,36 +1349,38 @@ class ConferenceApi(remote.Service):
     )
     def getConferenceSessionsByType(self, request):
         """Given a conference, return all sessions of a specified type"""
-
-        wsck = request.websafeConferenceKey
-        conf = self._checkEntityKey(wsck, CONFERENCE)
-
-        # get all sessions of specified type for a specified conference
-        sessions = Session.query(
-            Session.typeOfSession == request.typeOfSession, ancestor=conf.key
-        )
+        agenda = self._getAgenda(request.websafeConferenceKey)
 
         # return set of SessionForm objects per Session
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return self._agendaForms(agenda, 'byType', request.typeOfSession)
 
     @endpoints.method(
-        SESSION_GET_REQUEST,
+        SPEAKER_GET_REQUEST,
         SessionForms,
         path='speaker/{speaker}/sessions',
         http_method='GET',
         name='getSessionsBySpeaker'
     )
     def getSessionsBySpeaker(self, request):
-        """Return all sessions of a specified type"""
+        """Return all sessions of a specified speaker, across conferences"""
+        if not Speaker.normalise(request.speaker):
+            raise endpoints.BadRequestException("Speaker name required.")
+        page_size, offset = self._offsetPage(request)
 
-        # get all sessions with the provided speaker
-        sessions = Session.query(Session.speaker == request.speaker)
+        # the Speaker entry lists its session keys; no Session query
+        entry = Speaker.keyFor(request.speaker).get()
+        s_keys = entry.sessionKeys if entry else []
+        futures = ndb.get_multi_async(s_keys[offset:offset + page_size])
+        next_offset = offset + page_size
 
         # return set of SessionForm objects per Session
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[
+                self._copySessionToForm(future.get_result())
+                for future in futures if future.get_result()
+            ],
+            nextCursor=(
+                str(next_offset) if next_offset < len(s_keys) else None)
         )
 
     @endpoints.method(
@@ -584,21 +1392,15 @@ class ConferenceApi(remote.Service):
     )
     def getConferenceSessionsByDate(self, request):
         """Given a conference, return all sessions of a specified date"""
-
-        wsck = request.websafeConferenceKey
-        conf = self._checkEntityKey(wsck, CONFERENCE)
-
-        # get all sessions on a specified date for a specified conference
-        sessions = Session.query(
-            Session.date == datetime.strptime(
-                request.date[:10], "%Y-%m-%d"
-            ).date(), ancestor=conf.key
-        )
+        agenda = self._getAgenda(request.websafeConferenceKey)
+        try:
+            date = datetime.strptime(request.date[:10], "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            raise endpoints.BadRequestException(
+                "Date must be formatted as YYYY-MM-DD.")
 
         # return set of SessionForm objects per Session
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return self._agendaForms(agenda, 'byDate', str(date))
 
     @endpoints.method(
         SESSION_GET_REQUEST,
@@ -610,21 +1412,10 @@ class ConferenceApi(remote.Service):
     )
     def getConferenceSessionsByHighlight(self, request):
         """Given a conference, return all sessions with specified highlight"""
-
-        # fetch existing conference
-        wsck = request.websafeConferenceKey
-        conf = self._checkEntityKey(wsck, CONFERENCE)
-
-        # get all sessions with specified highlight for a specified conference
-        sessions = Session.query(
-            Session.highlights == request.highlight,
-            ancestor=conf.key
-        )
+        agenda = self._getAgenda(request.websafeConferenceKey)
 
         # return set of SessionForm objects per Session
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return self._agendaForms(agenda, 'byHighlight', request.highlight)
 
 # - - - Wishlist objects - - - - - - - - - - - - - - - - - -
 
@@ -635,23 +1426,21 @@ class ConferenceApi(remote.Service):
     def addSessionToWishlist(self, request):
         """Given a session, add it to the users wishlist"""
 
-        # Get the current user
-        user = endpoints.get_current_user()
-        user_id = getUserId(user)
         # Get the profile for the current user
-        profile_key = ndb.Key(Profile, user_id)
-        profile = profile_key.get()
+        profile = self._getProfileFromUser()
         # Check if the session is already in the wishlist
         # if it's not add it
 
         session = self._checkEntityKey(request.websafeSessionKey, SESSION)
 
-        if session.key in profile.wishlist:
-            return StringMessage(data="Session already in wishlist!")
-        else:
-            profile.wishlist.append(session.key)
-            profile.put()
+        if profile.addToWishlist(session.key):
+            self._markProfileDirty('wishlist')
+            self._flushProfile()
+            self._invalidateWishlistCache(profile.key.id())
             return StringMessage(data="Session added to wishlist!")
+        else:
+            self._flushProfile()
+            return StringMessage(data="Session already in wishlist!")
 
     @endpoints.method(
         WISHLIST_POST_REQUEST, StringMessage,
@@ -660,34 +1449,101 @@ class ConferenceApi(remote.Service):
     def deleteSessionInWishlist(self, request):
         """Given a session, delete it from the users wishlist"""
 
-        # Get the current user
-        user = endpoints.get_current_user()
-        user_id = getUserId(user)
         # Get the profile for the current user
-        profile_key = ndb.Key(Profile, user_id)
-        profile = profile_key.get()
+        profile = self._getProfileFromUser()
 
         session = self._checkEntityKey(request.websafeSessionKey, SESSION)
 
         # Check if the session is already in the wishlist
         # if it is, remove it
-        if session.key in profile.wishlist:
-            profile.wishlist.remove(session.key)
-            profile.put()
+        if profile.removeFromWishlist(session.key):
+            self._markProfileDirty('wishlist')
+            self._flushProfile()
+            self._invalidateWishlistCache(profile.key.id())
             return StringMessage(data="Session deleted from wishlist!")
         else:
+            self._flushProfile()
             return StringMessage(data="Session not in wishlist!")
 
+    @endpoints.method(
+        WishlistUpdateForm, StringMessage,
+        path='profile/wishlist/update',
+        http_method='POST', name='updateWishlist')
+    def updateWishlist(self, request):
+        """Add and remove several sessions in the users wishlist at once"""
+        add_keys = [
+            self._parseEntityKey(wssk, SESSION)
+            for wssk in request.addSessionKeys
+        ]
+        remove_keys = [
+            self._parseEntityKey(wssk, SESSION)
+            for wssk in request.removeSessionKeys
+        ]
+
+        # validate every session being added with a single get_multi;
+        # removals need not exist so stale entries can be cleared
+        profile = self._getProfileFromUser()
+        sessions = ndb.get_multi(add_keys)
+        for wssk, session in zip(request.addSessionKeys, sessions):
+            if not session:
+                raise endpoints.NotFoundException(
+                    'A %s with provided key was not found: %s'
+                    % (SESSION, wssk))
+
+        added = sum(1 for key in add_keys if profile.addToWishlist(key))
+        removed = sum(
+            1 for key in remove_keys if profile.removeFromWishlist(key))
+
+        # write the profile once for the whole batch
+        if added or removed:
+            self._markProfileDirty('wishlist')
+            self._flushProfile()
+            self._invalidateWishlistCache(profile.key.id())
+        else:
+            self._flushProfile()
+        return StringMessage(
+            data="%d session(s) added to and %d removed from wishlist!"
+            % (added, removed))
+
     @endpoints.method(
         message_types.VoidMessage, SessionForms,
         path='profile/wishlist',
         http_method='GET', name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
         """Return all sessions in logged-in user's wishlist."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        # serve the serialised forms from memcache when we can; the
+        # version is read before the profile, so a response built from
+        # a profile older than the last write lands under a retired key
+        cache_key = '%s%s:%d' % (
+            MEMCACHE_WISHLIST_PREFIX, user_id, self._generation(
+                MEMCACHE_WISHLIST_VERSION_PREFIX + user_id))
+        cached = memcache.get(cache_key)
+        if cached is not None:
+            return protojson.decode_message(SessionForms, cached)
+
         profile = self._getProfileFromUser()
+        self._flushProfile()
         sessions = ndb.get_multi(profile.wishlist)
-        return SessionForms(
-            items=[self._copySessionToForm(s) for s in sessions])
+        forms = SessionForms(
+            items=[self._copySessionToForm(s) for s in sessions if s])
+        memcache.set(
+            cache_key, protojson.encode_message(forms),
+            time=MEMCACHE_WISHLIST_TTL)
+        return forms
+
+    @staticmethod
+    def _invalidateWishlistCache(user_id):
+        """Retire the cached getSessionsInWishlist response of a user.
+
+        Called after the profile is written.
+        """
+        ConferenceApi._bumpGeneration(
+            MEMCACHE_WISHLIST_VERSION_PREFIX + user_id)
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
@@ -712,7 +1568,14 @@ class ConferenceApi(remote.Service):
     def _getProfileFromUser(self):
         """
         Return user Profile from datastore, creating new one if non-existent.
+
+        Outside transactions the profile is loaded once per request; a
+        newly created profile is only written by _flushProfile. Inside
+        a transaction it is always read fresh, and the caller puts it.
         """
+        if self._profile and not ndb.in_transaction():
+            return self._profile
+
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -723,6 +1586,7 @@ class ConferenceApi(remote.Service):
         p_key = ndb.Key(Profile, user_id)
         profile = p_key.get()
         # create new Profile if not there
+        dirty = set()
         if not profile:
             profile = Profile(
                 key=p_key,
@@ -730,23 +1594,57 @@ class ConferenceApi(remote.Service):
                 mainEmail=user.email(),
                 teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
-
+            dirty.update(('displayName', 'mainEmail', 'teeShirtSize'))
+
+        if ndb.in_transaction():
+            # the transaction writes its own copy; drop the cached one
+            self._profile = None
+            self._profileDirty.clear()
+            if dirty:
+                # a lookup may have cached this user as having no name
+                self._invalidateOrganizerName(user_id)
+        else:
+            self._profile = profile
+            self._profileDirty = dirty
         return profile      # return Profile
 
+    def _markProfileDirty(self, *fields):
+        """Record fields of the request's profile that need writing."""
+        self._profileDirty.update(fields)
+
+    def _flushProfile(self):
+        """Write the request's profile once if anything changed."""
+        if not self._profile or not self._profileDirty:
+            return
+        self._profile.put()
+        if 'displayName' in self._profileDirty:
+            self._invalidateOrganizerName(self._profile.key.id())
+        self._profileDirty.clear()
+
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
         # get user Profile
         prof = self._getProfileFromUser()
 
         # if saveProfile(), process user-modifyable fields
+        name_changed = False
         if save_request:
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
-                    if val:
+                    if val and getattr(prof, field) != str(val):
                         setattr(prof, field, str(val))
-                        prof.put()
+                        self._markProfileDirty(field)
+            name_changed = 'displayName' in self._profileDirty
+
+        # write all changes with a single put
+        self._flushProfile()
+        if name_changed:
+            # copy the new name onto the user's conferences
+            taskqueue.add(
+                params={'organizerUserId': prof.key.id()},
+                url='/tasks/update_organizer_name'
+            )
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -773,31 +1671,191 @@ class ConferenceApi(remote.Service):
         """Update & return user profile."""
         return self._doProfile(request)
 
+# - - - Confirmation email - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _confirmationEmailTask(item, countdown=None):
+        """Return the pull task for one confirmation email."""
+        return taskqueue.Task(
+            payload=json.dumps(item), method='PULL', countdown=countdown)
+
+    @staticmethod
+    def _addTasks(queue, tasks):
+        """Add tasks to queue, as few at a time as the API allows."""
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+    @staticmethod
+    def _queueConfirmationEmails(email, c_keys):
+        """Queue the confirmation emails for new conferences."""
+        ConferenceApi._addTasks(
+            taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE), [
+                ConferenceApi._confirmationEmailTask({
+                    'email': email,
+                    'websafeConferenceKey': c_key.urlsafe(),
+                    'attempts': 0,
+                }) for c_key in c_keys
+            ]
+        )
+
+    @staticmethod
+    def _renderConfirmationEmail(conf):
+        """Return the confirmation email body for a conference."""
+        fields = [
+            ('Name', conf.name),
+            ('Description', conf.description),
+            ('Topics', ', '.join(conf.topics)),
+            ('City', conf.city),
+            ('Start date', conf.startDate),
+            ('End date', conf.endDate),
+            ('Attendees', conf.maxAttendees),
+        ]
+        return CONFIRMATION_EMAIL_TPL % '\r\n'.join(
+            '%s: %s' % (label, value)
+            for label, value in fields if value not in (None, '')
+        )
+
+    @staticmethod
+    def _sendConfirmationEmails(deadline, rate=CONFIRMATION_EMAIL_RATE):
+        """Send queued confirmation emails until the queue or time runs out.
+
+        Emails are sent at most rate per second, and no more are leased
+        than can be sent before deadline. A failed send is queued again
+        with its attempt count after a backoff that doubles with every
+        attempt; after CONFIRMATION_EMAIL_MAX_ATTEMPTS it is dropped.
+        """
+        queue = taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE)
+        sender = 'noreply@%s.appspotmail.com' % (
+            app_identity.get_application_id())
+        interval = 1.0 / rate
+        while True:
+            budget = int((deadline - time.time()) * rate)
+            if budget < 1:
+                return
+            tasks = queue.lease_tasks(
+                CONFIRMATION_EMAIL_LEASE_SECONDS,
+                min(CONFIRMATION_EMAIL_LEASE_SIZE, budget))
+            if not tasks:
+                return
+            items = [json.loads(task.payload) for task in tasks]
+            confs = ndb.get_multi([
+                ndb.Key(urlsafe=item['websafeConferenceKey'])
+                for item in items
+            ])
+
+            done, retries = [], []
+            try:
+                for task, item, conf in zip(tasks, items, confs):
+                    if time.time() >= deadline:
+                        # sends ran slow; the rest are leased again
+                        # once their lease runs out
+                        return
+                    done.append(task)
+                    if not conf:
+                        # the conference was deleted; nothing to confirm
+                        continue
+                    started = time.time()
+                    try:
+                        mail.send_mail(
+                            sender, item['email'],
+                            CONFIRMATION_EMAIL_SUBJECT,
+                            ConferenceApi._renderConfirmationEmail(conf))
+                    except Exception:
+                        attempts = item.get('attempts', 0) + 1
+                        if attempts >= CONFIRMATION_EMAIL_MAX_ATTEMPTS:
+                            logging.exception(
+                                'Dropping confirmation email to %s',
+                                item['email'])
+                        else:
+                            logging.warning(
+                                'Confirmation email to %s failed; retrying',
+                                item['email'], exc_info=True)
+                            item['attempts'] = attempts
+                            retries.append(
+                                ConferenceApi._confirmationEmailTask(
+                                    item, countdown=CONFIRMATION_EMAIL_BACKOFF
+                                    * 2 ** (attempts - 1)))
+                    time.sleep(max(0, interval - (time.time() - started)))
+            finally:
+                # requeue failures before dropping the tasks they replace
+                ConferenceApi._addTasks(queue, retries)
+                if done:
+                    queue.delete_tasks(done)
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _isNearlySoldOut(seats):
+        return 0 < seats <= NEARLY_SOLD_OUT_SEATS
+
+    @staticmethod
+    def _crossesSoldOutThreshold(before, after):
+        """Return True if a seat change moves a conference in or out."""
+        return (ConferenceApi._isNearlySoldOut(before) !=
+                ConferenceApi._isNearlySoldOut(after))
+
+    @staticmethod
+    def _announcementText(announcement):
+        """Format the announcement for the nearly sold out conferences."""
+        if not announcement or not announcement.nearlySoldOut:
+            return ""
+        return ANNOUNCEMENT_TPL % (
+            ', '.join(sorted(announcement.nearlySoldOut.values())))
+
+    @staticmethod
+    def _refreshNearlySoldOut(c_key):
+        """Move one conference into or out of the nearly sold out set.
+
+        The conference is re-read with the set, so refreshes that run
+        out of order still leave the set matching the datastore.
+        """
+        @ndb.transactional(xg=True)
+        def _update():
+            conf, announcement = ndb.get_multi([c_key, Announcement.keyFor()])
+            announcement = announcement or Announcement(
+                key=Announcement.keyFor(), nearlySoldOut={})
+            wsck = c_key.urlsafe()
+            if conf and ConferenceApi._isNearlySoldOut(conf.seatsAvailable):
+                if announcement.nearlySoldOut.get(wsck) == conf.name:
+                    return False
+                announcement.nearlySoldOut[wsck] = conf.name
+            elif wsck in announcement.nearlySoldOut:
+                del announcement.nearlySoldOut[wsck]
+            else:
+                return False
+            announcement.put()
+            return True
+
+        if _update():
+            # getAnnouncement re-reads the entity on its next call
+            HOME_PAGE_CACHE.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Reconcile the nearly sold out set & assign to memcache; used
+        by the reconciliation cron job.
+
+        Registrations and updates keep the set current as conferences
+        cross the thresholds; this corrects any refresh that was lost.
+        The query is only eventually consistent, so it just picks the
+        conferences to recheck; each one is then moved in or out by
+        _refreshNearlySoldOut, in a transaction with the set.
         """
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
+        found = dict((conf.key.urlsafe(), conf.name) for conf in confs)
 
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        announcement = Announcement.keyFor().get()
+        listed = announcement.nearlySoldOut if announcement else {}
+        for wsck in set(found) | set(listed):
+            if found.get(wsck) != listed.get(wsck):
+                ConferenceApi._refreshNearlySoldOut(ndb.Key(urlsafe=wsck))
 
-        return announcement
+        # getAnnouncement re-reads the entity on its next call
+        HOME_PAGE_CACHE.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        return ConferenceApi._announcementText(Announcement.keyFor().get())
 
     @endpoints.method(
         message_types.VoidMessage,
@@ -807,52 +1865,119 @@ class ConferenceApi(remote.Service):
         name='getAnnouncement'
     )
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if not announcement:
-            announcement = ""
+        """Return Announcement from the home page cache."""
+        announcement = HOME_PAGE_CACHE.get(
+            MEMCACHE_ANNOUNCEMENTS_KEY,
+            lambda: self._announcementText(Announcement.keyFor().get())
+        )
         return StringMessage(data=announcement)
 
 # - - - Featured Speaker - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(
-        message_types.VoidMessage,
+        CONF_GET_REQUEST,
         StringMessage,
-        path='conference/featured_speaker/get',
+        path='conference/{websafeConferenceKey}/featured_speaker',
         http_method='GET',
         name='getFeaturedSpeaker'
     )
     def getFeaturedSpeaker(self, request):
-        """Return Featured Speaker from memcache."""
-        speaker = memcache.get(MEMCACHE_SPEAKER_KEY)
+        """Return Featured Speaker of a conference from the cache."""
+        wsck = request.websafeConferenceKey
+        c_key = self._parseEntityKey(wsck, CONFERENCE)
+        speaker = HOME_PAGE_CACHE.get(
+            MEMCACHE_SPEAKER_PREFIX + c_key.urlsafe(),
+            lambda: self._featuredSpeakerText(c_key)
+        )
 
-        return StringMessage(data=speaker or "")
+        return StringMessage(data=speaker)
 
     @staticmethod
-    def _cacheSpeaker(speaker, wsck):
-        """
-        Create Featured Speaker and assign to memcache via task queue
+    @ndb.transactional()
+    def _tallySpeaker(session):
+        """Count a new session in its conference's speaker tally.
+
+        A speaker with more than one session in the conference becomes
+        its featured speaker. The first tally of a conference is seeded
+        from the sessions it already has.
         """
+        if not session.speaker:
+            return
+        c_key = session.key.parent()
+        t_key = FeaturedSpeaker.keyFor(c_key)
+        tally = t_key.get()
+        if not tally:
+            tally = FeaturedSpeaker(key=t_key, sessionNames={})
+            for older in Session.query(ancestor=c_key):
+                if older.speaker and older.key != session.key:
+                    tally.sessionNames.setdefault(
+                        older.speaker, []).append(older.name)
+
+        names = tally.sessionNames.setdefault(session.speaker, [])
+        names.append(session.name)
+        if len(names) > 1:
+            tally.speaker = session.speaker
+        tally.put()
 
-        speaker_message = memcache.get(MEMCACHE_SPEAKER_KEY) or ""
+    @staticmethod
+    def _scheduleSpeakerRefresh(c_key):
+        """Queue at most one Featured Speaker refresh per SPEAKER_WINDOW.
 
-        conf = ConferenceApi._checkEntityKey(wsck, CONFERENCE)
+        The tally is per conference, so sessions added for any speaker
+        of the conference share one task.
+        """
+        # the canonical urlsafe form has no '=' padding, which task
+        # names cannot contain
+        ConferenceApi._addCoalescedTask(
+            'set-speaker-%s' % c_key.urlsafe(), SPEAKER_WINDOW,
+            params={'websafeConferenceKey': c_key.urlsafe()},
+            url='/tasks/set_speaker'
+        )
 
-        sessions = Session.query(ancestor=conf.key)
-        sessions = sessions.filter(Session.speaker == speaker)
-        if sessions.count() > 1:
-            # If the sessions with the speaker is more than one
-            # format speaker_message and set it in memcache
-            speaker_message = SPEAKER_TPL % (
-                speaker, ', '.join(session.name for session in sessions)
-            )
-            memcache.set(MEMCACHE_SPEAKER_KEY, speaker_message)
+    @staticmethod
+    def _featuredSpeakerText(c_key):
+        """Format the Featured Speaker message from a conference's tally."""
+        tally = FeaturedSpeaker.keyFor(c_key).get()
+        if not tally or not tally.speaker:
+            return ""
+        return SPEAKER_TPL % (
+            tally.speaker, ', '.join(tally.sessionNames[tally.speaker]))
+
+    @staticmethod
+    def _cacheSpeaker(wsck):
+        """
+        Copy a conference's Featured Speaker to the cache via task queue
+        """
+        c_key = ConferenceApi._parseEntityKey(wsck, CONFERENCE)
+        speaker_message = ConferenceApi._featuredSpeakerText(c_key)
+        HOME_PAGE_CACHE.set(
+            MEMCACHE_SPEAKER_PREFIX + c_key.urlsafe(), speaker_message)
+        return speaker_message
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
+        conf = self._checkEntityKey(request.websafeConferenceKey, CONFERENCE)
+        if conf.queuedRegistration:
+            return self._queueRegistration(conf, reg)
+        if conf.seatShards:
+            return self._shardedRegistration(request, conf, reg)
+        retval, seats = self._entityRegistration(request, reg)
+        if retval.data:
+            # seatsAvailable changed
+            self._bumpConferenceGeneration()
+            if self._crossesSoldOutThreshold(*seats):
+                self._refreshNearlySoldOut(conf.key)
+        return retval
+
+    @ndb.transactional(xg=True)
+    def _entityRegistration(self, request, reg=True):
+        """Register or unregister, keeping seats on the Conference entity.
+
+        Returns the BooleanMessage and the conference's seatsAvailable
+        before and after, as read and written in the transaction.
+        """
         retval = None
         prof = self._getProfileFromUser()  # get user Profile
 
@@ -860,11 +1985,12 @@ class ConferenceApi(remote.Service):
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
         conf = self._checkEntityKey(wsck, CONFERENCE)
+        seats = conf.seatsAvailable
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if prof.isAttending(conf.key):
                 raise ConflictException(
                     "You have already registered for this conference")
 
@@ -874,26 +2000,313 @@ class ConferenceApi(remote.Service):
                     "There are no seats available.")
 
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
+            prof.addConferenceToAttend(conf.key)
             conf.seatsAvailable -= 1
             retval = True
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if prof.removeConferenceToAttend(conf.key):
 
                 # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
                 conf.seatsAvailable += 1
                 retval = True
             else:
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        ndb.put_multi([prof, conf, ConferenceSummary.fromConference(conf)])
+        return BooleanMessage(data=retval), (seats, conf.seatsAvailable)
+
+    def _shardedRegistration(self, request, conf, reg=True):
+        """Register or unregister, taking the seat from a random shard."""
+        wsck = request.websafeConferenceKey
+        shard_keys = self._seatShardKeys(conf.key, conf.seatShards)
+
+        if reg:
+            # only try shards that still looked to have seats left
+            shards = ndb.get_multi(shard_keys)
+            candidates = [
+                shard.key for shard in shards
+                if shard and shard.seatsAvailable > 0
+            ]
+            random.shuffle(candidates)
+            # with no candidates, still run one transaction so an
+            # existing registration is reported as such
+            candidates = candidates[:SEAT_SHARD_ATTEMPTS] or shard_keys[:1]
+        else:
+            candidates = [random.choice(shard_keys)]
+
+        for shard_key in candidates:
+            retval = self._shardRegistration(wsck, shard_key, reg)
+            if retval is None:
+                # shard ran out of seats since it was read; try another
+                continue
+            if retval:
+                self._scheduleSeatSync(conf.key)
+            return BooleanMessage(data=retval)
+
+        raise ConflictException(
+            "There are no seats available.")
+
+    @ndb.transactional(xg=True)
+    def _shardRegistration(self, wsck, shard_key, reg=True):
+        """Move one seat between the user's Profile and a SeatShard.
+
+        Returns None when registering against a shard with no seats left.
+        """
+        prof = self._getProfileFromUser()  # get user Profile
+        shard = shard_key.get()
+
+        if reg:
+            if prof.isAttending(wsck):
+                raise ConflictException(
+                    "You have already registered for this conference")
+            if shard.seatsAvailable <= 0:
+                return None
+            prof.addConferenceToAttend(wsck)
+            shard.seatsAvailable -= 1
+        else:
+            if not prof.removeConferenceToAttend(wsck):
+                return False
+            shard.seatsAvailable += 1
+
+        ndb.put_multi([prof, shard])
+        return True
+
+    def _queueRegistration(self, conf, reg=True):
+        """Accept an (un)registration for later batch processing.
+
+        Returns as soon as the request is queued; clients poll
+        getRegistrationStatus for the outcome.
+        """
+        prof = self._getProfileFromUser()  # get user Profile
+        # the batch worker needs the profile to exist
+        self._flushProfile()
+        # key records and tags by the canonical key, not the spelling
+        # the client happened to send
+        wsck = conf.key.urlsafe()
+        r_key = ndb.Key(RegistrationRequest, wsck, parent=prof.key)
+
+        if reg and prof.isAttending(conf.key):
+            raise ConflictException(
+                "You have already registered for this conference")
+        if not reg and not prof.isAttending(conf.key):
+            pending = r_key.get()
+            if not pending or pending.status != REGISTRATION_PENDING:
+                return BooleanMessage(data=False)
+
+        @ndb.transactional()
+        def _enqueue():
+            RegistrationRequest(
+                key=r_key, register=reg, status=REGISTRATION_PENDING
+            ).put()
+            taskqueue.Queue(REGISTRATION_QUEUE).add(
+                taskqueue.Task(
+                    payload=json.dumps({
+                        'userId': prof.key.id(),
+                        'register': reg,
+                    }),
+                    method='PULL',
+                    tag=wsck
+                ),
+                transactional=True
+            )
+        _enqueue()
+        return BooleanMessage(data=True)
+
+    @staticmethod
+    def _processRegistrationQueue(deadline):
+        """Apply queued registrations until the queue or time runs out.
+
+        Tasks are leased by tag, so each lease holds requests for one
+        conference; they are applied REGISTRATION_TXN_SIZE at a time.
+        A batch that fails is retried by later runs; after
+        REGISTRATION_MAX_ATTEMPTS failures its requests are rejected.
+        """
+        queue = taskqueue.Queue(REGISTRATION_QUEUE)
+        failed_tags = set()
+        while time.time() < deadline:
+            tasks = queue.lease_tasks_by_tag(
+                REGISTRATION_LEASE_SECONDS, REGISTRATION_LEASE_SIZE)
+            if not tasks:
+                break
+            if tasks[0].tag in failed_tags:
+                # the oldest requests left belong to a conference whose
+                # batch failed; applying newer ones first would reorder
+                # them, so leave everything to the next run
+                return
+            for i in range(0, len(tasks), REGISTRATION_TXN_SIZE):
+                batch = tasks[i:i + REGISTRATION_TXN_SIZE]
+                # tasks queued before tags were canonical may carry
+                # another spelling of the key
+                wsck = ndb.Key(urlsafe=batch[0].tag).urlsafe()
+                items = [json.loads(t.payload) for t in batch]
+                try:
+                    seats = ConferenceApi._applyRegistrations(wsck, items)
+                except Exception:
+                    logging.exception(
+                        'Queued registrations for %s failed', wsck)
+                    # count attempts ourselves: every lease raises
+                    # retry_count, attempted or not
+                    attempts = memcache.incr(
+                        MEMCACHE_REGISTRATION_ATTEMPTS_PREFIX + batch[0].name,
+                        initial_value=0)
+                    if attempts < REGISTRATION_MAX_ATTEMPTS:
+                        # the rest of the lease is retried once it expires
+                        failed_tags.add(batch[0].tag)
+                        break
+                    ConferenceApi._rejectRegistrations(wsck, items)
+                    queue.delete_tasks(batch)
+                    continue
+                ConferenceApi._bumpConferenceGeneration()
+                # only drop the tasks once their batch has committed
+                queue.delete_tasks(batch)
+                if seats and ConferenceApi._crossesSoldOutThreshold(*seats):
+                    ConferenceApi._refreshNearlySoldOut(
+                        ndb.Key(urlsafe=wsck))
+
+    @staticmethod
+    def _rejectRegistrations(wsck, items):
+        """Mark queued requests that could not be applied as rejected."""
+        requests = dict(
+            (item['userId'], RegistrationRequest(
+                key=ndb.Key(RegistrationRequest, wsck,
+                            parent=ndb.Key(Profile, item['userId'])),
+                register=item['register'],
+                status=REGISTRATION_REJECTED
+            )) for item in items
+        )
+        ndb.put_multi(requests.values())
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _applyRegistrations(wsck, items):
+        """Apply a batch of queued (un)registrations for one conference.
+
+        Returns the conference's seatsAvailable before and after the
+        batch, or None if the conference no longer exists.
+        """
+        c_key = ndb.Key(urlsafe=wsck)
+        user_ids = list(set(item['userId'] for item in items))
+        p_keys = [ndb.Key(Profile, user_id) for user_id in user_ids]
+        r_keys = [
+            ndb.Key(RegistrationRequest, wsck, parent=p_key)
+            for p_key in p_keys
+        ]
+        entities = ndb.get_multi([c_key] + p_keys + r_keys)
+        conf = entities[0]
+        profiles = dict(zip(user_ids, entities[1:len(p_keys) + 1]))
+        requests = dict(zip(user_ids, entities[len(p_keys) + 1:]))
+        seats = conf.seatsAvailable if conf else None
+
+        # apply in queue order so repeated requests by a user resolve
+        # to the most recent one
+        for item in items:
+            prof = profiles[item['userId']]
+            if not prof:
+                continue
+            r_key = ndb.Key(RegistrationRequest, wsck, parent=prof.key)
+            req = requests[item['userId']] or RegistrationRequest(key=r_key)
+            requests[item['userId']] = req
+            req.register = item['register']
+
+            if not conf:
+                req.status = REGISTRATION_REJECTED
+            elif item['register']:
+                if prof.isAttending(c_key):
+                    req.status = REGISTRATION_REGISTERED
+                elif conf.seatsAvailable > 0:
+                    prof.addConferenceToAttend(c_key)
+                    conf.seatsAvailable -= 1
+                    req.status = REGISTRATION_REGISTERED
+                else:
+                    req.status = REGISTRATION_REJECTED
+            else:
+                if prof.removeConferenceToAttend(c_key):
+                    conf.seatsAvailable += 1
+                req.status = REGISTRATION_UNREGISTERED
+
+        to_put = profiles.values() + requests.values()
+        if conf:
+            to_put += [conf, ConferenceSummary.fromConference(conf)]
+        ndb.put_multi([entity for entity in to_put if entity])
+        return (seats, conf.seatsAvailable) if conf else None
+
+    @staticmethod
+    def _seatShardKeys(c_key, shards):
+        """Return the SeatShard keys of a conference."""
+        # shards are root entities so each is its own entity group
+        return [
+            ndb.Key(SeatShard, '%s:%d' % (c_key.urlsafe(), i))
+            for i in range(shards)
+        ]
+
+    @staticmethod
+    def _createSeatShards(c_key, seats, shards):
+        """Return unsaved SeatShards splitting seats evenly."""
+        base, extra = divmod(seats, shards)
+        return [
+            SeatShard(
+                key=shard_key,
+                seatsAvailable=base + (1 if i < extra else 0)
+            ) for i, shard_key in enumerate(
+                ConferenceApi._seatShardKeys(c_key, shards))
+        ]
+
+    @staticmethod
+    def _addCoalescedTask(name, window, **kwargs):
+        """Add a task named for the current window of window seconds.
+
+        Tasks added under the same name within one window collapse into
+        the first; it runs once the window has closed.
+        """
+        bucket = int(time.time()) // window
+        try:
+            taskqueue.add(
+                name='%s-%d' % (name, bucket), countdown=window, **kwargs)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            # a task for this window is already queued
+            pass
+
+    @staticmethod
+    def _scheduleSeatSync(c_key):
+        """Queue at most one seatsAvailable refresh per SEAT_SYNC_WINDOW."""
+        ConferenceApi._addCoalescedTask(
+            'sync-seats-%s' % c_key.urlsafe(), SEAT_SYNC_WINDOW,
+            params={'websafeConferenceKey': c_key.urlsafe()},
+            url='/tasks/sync_seats'
+        )
+
+    @staticmethod
+    def _syncSeatsAvailable(wsck):
+        """Copy the summed shard seats onto Conference.seatsAvailable."""
+        c_key = ndb.Key(urlsafe=wsck)
+        conf = c_key.get()
+        if not conf or not conf.seatShards:
+            return
+        shards = ndb.get_multi(
+            ConferenceApi._seatShardKeys(c_key, conf.seatShards))
+        seats = sum(shard.seatsAvailable for shard in shards if shard)
+
+        @ndb.transactional()
+        def _update():
+            """Return the previous seatsAvailable if it changed."""
+            conf = c_key.get()
+            if conf.seatsAvailable != seats:
+                previous = conf.seatsAvailable
+                conf.seatsAvailable = seats
+                ndb.put_multi(
+                    [conf, ConferenceSummary.fromConference(conf)])
+                return previous
+            return None
+        previous = _update()
+        if previous is not None:
+            ConferenceApi._bumpConferenceGeneration()
+            if ConferenceApi._crossesSoldOutThreshold(previous, seats):
+                ConferenceApi._refreshNearlySoldOut(c_key)
 
     @endpoints.method(
         message_types.VoidMessage,
@@ -905,30 +2318,30 @@ class ConferenceApi(remote.Service):
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser()  # get user Profile
-        conf_keys = [
-            ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend
-        ]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [
-            ndb.Key(Profile, conf.organizerUserId) for conf in conferences
-        ]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        self._flushProfile()
+        return self._getConferencesToAttendAsync(prof).get_result()
+
+    @ndb.tasklet
+    def _getConferencesToAttendAsync(self, prof):
+        """Fetch attended conferences and their organisers concurrently."""
+        conf_keys = prof.conferenceKeys()
+        # organisers are the conferences' parents, so their names can
+        # be looked up alongside the conferences rather than after them
+        conferences, names = yield (
+            ndb.get_multi_async(conf_keys),
+            self._getOrganizerNamesAsync(
+                [c_key.parent().id() for c_key in conf_keys]
+            )
+        )
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[
+        raise ndb.Return(ConferenceForms(items=[
                 self._copyConferenceToForm(
                     conf,
-                    names[conf.organizerUserId]
-                ) for conf in conferences
+                    names.get(conf.organizerUserId)
+                ) for conf in conferences if conf
             ]
-        )
+        ))
 
     @endpoints.method(
         CONF_GET_REQUEST,
@@ -952,6 +2365,28 @@ class ConferenceApi(remote.Service):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
 
+    @endpoints.method(
+        CONF_GET_REQUEST,
+        StringMessage,
+        path='conference/{websafeConferenceKey}/registration',
+        http_method='GET',
+        name='getRegistrationStatus'
+    )
+    def getRegistrationStatus(self, request):
+        """Return the user's registration status for a conference."""
+        prof = self._getProfileFromUser()  # get user Profile
+        self._flushProfile()
+        c_key = self._parseEntityKey(request.websafeConferenceKey, CONFERENCE)
+        req = ndb.Key(
+            RegistrationRequest, c_key.urlsafe(), parent=prof.key).get()
+        if req:
+            status = req.status
+        elif prof.isAttending(c_key):
+            status = REGISTRATION_REGISTERED
+        else:
+            status = REGISTRATION_NONE
+        return StringMessage(data=status)
+
     @endpoints.method(
         message_types.VoidMessage,
         ConferenceForms,
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""
+conference_index.py -- in-memory columnar index of small Conference
+    fields, used to answer conference filters the datastore cannot
+    (inequalities on more than one property)
+
+"""
+
+import logging
+import operator
+import threading
+import time
+
+import numpy
+from models import Conference
+
+
+COMPARATORS = {
+    '=':  operator.eq,
+    '>':  operator.gt,
+    '>=': operator.ge,
+    '<':  operator.lt,
+    '<=': operator.le,
+    '!=': operator.ne,
+}
+
+NUMERIC_FIELDS = ('month', 'maxAttendees', 'seatsAvailable')
+# stands in for missing numbers; like datastore nulls it sorts first
+NUMERIC_NULL = numpy.iinfo(numpy.int64).min
+REFRESH_INTERVAL = 5 * 60
+BATCH_SIZE = 1000
+
+
+class ConferenceIndex(object):
+    """Columnar snapshot of Conference fields, rebuilt periodically.
+
+    A stale snapshot keeps being served while a background thread
+    rebuilds it; only the first build of an instance, normally done by
+    its warmup request, makes a request wait.
+
+    Rows are kept in Conference.name order, so filtering with boolean
+    masks yields keys in the same order the datastore query would.
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def search(self, filters):
+        """Return keys of conferences matching all filters.
+
+        filters are dicts of field/operator/value as produced by
+        ConferenceApi._parseFilters.
+        """
+        snapshot = self._getSnapshot()
+        mask = numpy.ones(len(snapshot['keys']), dtype=bool)
+        for filtr in filters:
+            mask &= self._mask(snapshot, filtr)
+        return [snapshot['keys'][i] for i in numpy.flatnonzero(mask)]
+
+    @staticmethod
+    def matches(conf, filters):
+        """Check a single Conference against filters.
+
+        Used to drop results that changed since the snapshot was built.
+        """
+        for filtr in filters:
+            compare = COMPARATORS[filtr["operator"]]
+            value = getattr(conf, filtr["field"])
+            values = value if isinstance(value, list) else [value]
+            if not any(compare(v, filtr["value"]) for v in values):
+                return False
+        return True
+
+    def _mask(self, snapshot, filtr):
+        compare = COMPARATORS[filtr["operator"]]
+        field, value = filtr["field"], filtr["value"]
+        if field == 'topics':
+            # repeated property: a row matches when any of its topics does
+            mask = numpy.zeros(len(snapshot['keys']), dtype=bool)
+            for topic, topic_mask in snapshot['topics'].iteritems():
+                if compare(topic, value):
+                    mask |= topic_mask
+            return mask
+        return numpy.asarray(compare(snapshot[field], value), dtype=bool)
+
+    def refresh(self):
+        """Rebuild the snapshot now, e.g. from a warmup request."""
+        with self._lock:
+            self._snapshot = self._build()
+
+    def _getSnapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            # nothing to serve yet; one thread builds, the others wait
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._build()
+                return self._snapshot
+        if snapshot['built'] + self.refresh_interval <= time.time():
+            self._refreshInBackground()
+        return snapshot
+
+    def _refreshInBackground(self):
+        """Rebuild in another thread; requests serve the stale snapshot."""
+        if not self._lock.acquire(False):
+            # already rebuilding
+            return
+
+        def rebuild():
+            try:
+                self._snapshot = self._build()
+            except Exception:
+                logging.exception('Rebuilding the conference index failed')
+            finally:
+                self._lock.release()
+
+        thread = threading.Thread(target=rebuild)
+        thread.daemon = True
+        thread.start()
+
+    @staticmethod
+    def _build():
+        # keys in name order plus one single-property projection per
+        # field, all run at once; full entities, descriptions included,
+        # are never loaded, and nothing goes into the caches
+        options = dict(
+            batch_size=BATCH_SIZE, use_cache=False, use_memcache=False)
+        keys_future = Conference.query().order(Conference.name).fetch_async(
+            keys_only=True, **options)
+        field_futures = dict(
+            (field, Conference.query(
+                projection=[getattr(Conference, field)]
+            ).fetch_async(**options))
+            for field in ('city', 'topics') + NUMERIC_FIELDS
+        )
+
+        keys = keys_future.get_result()
+        rows = dict((key, i) for i, key in enumerate(keys))
+        snapshot = {
+            'built': time.time(),
+            'keys': keys,
+            'city': numpy.array([None] * len(keys), dtype=object),
+            'topics': {},
+        }
+        for field in NUMERIC_FIELDS:
+            snapshot[field] = numpy.empty(len(keys), dtype=numpy.int64)
+            snapshot[field].fill(NUMERIC_NULL)
+
+        for field, future in field_futures.iteritems():
+            for conf in future.get_result():
+                i = rows.get(conf.key)
+                if i is None:
+                    # created after the key query ran
+                    continue
+                value = getattr(conf, field)
+                if field == 'topics':
+                    # one result per topic of a conference
+                    for topic in value:
+                        if topic not in snapshot['topics']:
+                            snapshot['topics'][topic] = numpy.zeros(
+                                len(keys), dtype=bool)
+                        snapshot['topics'][topic][i] = True
+                elif value is not None:
+                    snapshot[field][i] = value
+        return snapshot
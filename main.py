@@ -12,10 +12,17 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import time
+
 import webapp2
+import yaml
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+from conference import CONFERENCE_INDEX
+from conference import CONFERENCE_PLANNER
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -24,9 +31,21 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send queued Conference confirmation emails in batches."""
+        # stay well inside the cron request deadline
+        ConferenceApi._sendConfirmationEmails(time.time() + 45)
+        self.response.set_status(204)
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation.
+
+        Only drains push tasks queued before the confirmation-emails
+        pull queue existed.
+        """
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -39,13 +58,104 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
 
 class SetFeaturedSpeaker(webapp2.RequestHandler):
     def post(self):
-        """Set Featured Speaker in Memcache."""
-        ConferenceApi._cacheSpeaker(self.request.get('speaker'), self.request.get('websafeConferenceKey'))
+        """Set Featured Speaker in the cache for one or more Conferences."""
+        for wsck in set(self.request.get_all('websafeConferenceKey')):
+            ConferenceApi._cacheSpeaker(wsck)
+        self.response.set_status(204)
+
+class ProcessRegistrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Apply queued conference registrations in batches."""
+        # stay well inside the cron request deadline
+        ConferenceApi._processRegistrationQueue(time.time() + 45)
         self.response.set_status(204)
 
+class RebuildAgendaHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild the agenda snapshot of a Conference."""
+        ConferenceApi._buildAgenda(
+            ndb.Key(urlsafe=self.request.get('websafeConferenceKey')))
+        self.response.set_status(204)
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Refresh seatsAvailable of a Conference from its seat shards."""
+        ConferenceApi._syncSeatsAvailable(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy an organiser's new displayName onto their Conferences."""
+        user_id = self.request.get('organizerUserId')
+        cursor = ConferenceApi._updateOrganizerName(
+            user_id, self.request.get('cursor'))
+        if cursor:
+            # more conferences left; continue in a follow-up task
+            taskqueue.add(
+                params={'organizerUserId': user_id, 'cursor': cursor},
+                url='/tasks/update_organizer_name'
+            )
+        self.response.set_status(204)
+
+class BackfillOrganizerNamesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the one-off organizerDisplayName migration."""
+        self.post()
+
+    def post(self):
+        """Backfill organizerDisplayName on one batch of Conferences."""
+        cursor = ConferenceApi._backfillOrganizerNames(
+            self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(
+                params={'cursor': cursor},
+                url='/migrations/backfill_organizer_names'
+            )
+        self.response.set_status(204)
+
+class BackfillSpeakersHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the one-off Speaker index migration."""
+        self.post()
+
+    def post(self):
+        """Index the speakers of one batch of Sessions."""
+        cursor = ConferenceApi._backfillSpeakers(self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(
+                params={'cursor': cursor},
+                url='/migrations/backfill_speakers'
+            )
+        self.response.set_status(204)
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Build the conference index before the instance takes traffic."""
+        CONFERENCE_INDEX.refresh()
+        self.response.set_status(204)
+
+class IndexAdviceHandler(webapp2.RequestHandler):
+    def get(self):
+        """Suggest indexes for conference queries filtered in memory."""
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write(yaml.safe_dump(
+            {'indexes': CONFERENCE_PLANNER.suggestions()},
+            default_flow_style=False
+        ))
+
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/process_registrations', ProcessRegistrationsHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_speaker', SetFeaturedSpeaker),
+    ('/tasks/rebuild_agenda', RebuildAgendaHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/migrations/backfill_organizer_names', BackfillOrganizerNamesHandler),
+    ('/migrations/backfill_speakers', BackfillSpeakersHandler),
+    ('/admin/index_advice', IndexAdviceHandler),
+    ('/_ah/warmup', WarmupHandler),
 ], debug=True)
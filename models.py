@@ -13,11 +13,20 @@ created/forked from conferences.py by wesc on 2014 may 24
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 import httplib
+from collections import OrderedDict
+
 import endpoints
 from protorpc import messages
 from google.appengine.ext import ndb
 
 
+def _toKey(value):
+    """Normalise a Key or websafe key string to a Key."""
+    if isinstance(value, ndb.Key):
+        return value
+    return ndb.Key(urlsafe=value)
+
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
@@ -26,6 +35,68 @@ class Profile(ndb.Model):
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     wishlist = ndb.KeyProperty(kind="Session", repeated=True)
 
+    # Membership in conferenceKeysToAttend and wishlist goes through the
+    # methods below. Each list is mirrored into an ordered set of Keys on
+    # first use, making lookups, adds and removes O(1); the sets are
+    # written back to the repeated properties by _pre_put_hook.
+
+    def _keySet(self, name):
+        """Return the ordered Key set mirroring repeated property name."""
+        key_sets = self.__dict__.setdefault('_keySets', {})
+        if name not in key_sets:
+            key_sets[name] = OrderedDict(
+                (_toKey(value), None) for value in getattr(self, name))
+        return key_sets[name]
+
+    def _hasKey(self, name, key):
+        return _toKey(key) in self._keySet(name)
+
+    def _addKey(self, name, key):
+        keys = self._keySet(name)
+        key = _toKey(key)
+        if key in keys:
+            return False
+        keys[key] = None
+        return True
+
+    def _removeKey(self, name, key):
+        return self._keySet(name).pop(_toKey(key), False) is None
+
+    def conferenceKeys(self):
+        """Return Keys of the conferences the user attends."""
+        return list(self._keySet('conferenceKeysToAttend'))
+
+    def isAttending(self, c_key):
+        return self._hasKey('conferenceKeysToAttend', c_key)
+
+    def addConferenceToAttend(self, c_key):
+        """Add a conference; return False if it was already there."""
+        return self._addKey('conferenceKeysToAttend', c_key)
+
+    def removeConferenceToAttend(self, c_key):
+        """Remove a conference; return False if it was not there."""
+        return self._removeKey('conferenceKeysToAttend', c_key)
+
+    def isInWishlist(self, s_key):
+        return self._hasKey('wishlist', s_key)
+
+    def addToWishlist(self, s_key):
+        """Add a session; return False if it was already there."""
+        return self._addKey('wishlist', s_key)
+
+    def removeFromWishlist(self, s_key):
+        """Remove a session; return False if it was not there."""
+        return self._removeKey('wishlist', s_key)
+
+    def _pre_put_hook(self):
+        key_sets = self.__dict__.get('_keySets', {})
+        if 'conferenceKeysToAttend' in key_sets:
+            self.conferenceKeysToAttend = [
+                key.urlsafe() for key in key_sets['conferenceKeysToAttend']
+            ]
+        if 'wishlist' in key_sets:
+            self.wishlist = list(key_sets['wishlist'])
+
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -72,6 +143,52 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False)
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+    queuedRegistration = ndb.BooleanProperty(default=False, indexed=False)
+
+class Announcement(ndb.Model):
+    """Announcement -- the conferences that are nearly sold out"""
+    # websafe Conference key -> Conference name
+    nearlySoldOut   = ndb.JsonProperty()
+
+    @classmethod
+    def keyFor(cls):
+        """There is a single Announcement entity."""
+        return ndb.Key(cls, 'nearly_sold_out')
+
+class ConferenceSummary(ndb.Model):
+    """ConferenceSummary -- slim copy of a Conference for list views"""
+    name            = ndb.StringProperty(indexed=False)
+    topics          = ndb.StringProperty(repeated=True, indexed=False)
+    city            = ndb.StringProperty(indexed=False)
+    startDate       = ndb.DateProperty(indexed=False)
+    endDate         = ndb.DateProperty(indexed=False)
+    maxAttendees    = ndb.IntegerProperty(indexed=False)
+    seatsAvailable  = ndb.IntegerProperty(indexed=False)
+    organizerDisplayName = ndb.StringProperty(indexed=False)
+
+    @classmethod
+    def keyFor(cls, c_key):
+        """Summaries are single children of their Conference."""
+        return ndb.Key(cls, 1, parent=c_key)
+
+    @classmethod
+    def fromConference(cls, conf):
+        """Return an (unsaved) summary of conf; put it with conf."""
+        return cls(
+            key=cls.keyFor(conf.key),
+            **{name: getattr(conf, name) for name in cls._properties}
+        )
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a conference's available seats"""
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
+
+class RegistrationRequest(ndb.Model):
+    """RegistrationRequest -- queued (un)registration, child of Profile"""
+    register        = ndb.BooleanProperty(default=True, indexed=False)
+    status          = ndb.StringProperty(indexed=False)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -88,9 +205,46 @@ class ConferenceForm(messages.Message):
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
 
+class ConferenceImportForm(messages.Message):
+    """ConferenceImportForm -- conferences to create in bulk"""
+    items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    # one JSON ConferenceForm per line, imported after items
+    jsonl = messages.StringField(2)
+
+
+class ConferenceImportResult(messages.Message):
+    """ConferenceImportResult -- outcome of one imported conference"""
+    index = messages.IntegerField(1, variant=messages.Variant.INT32)
+    websafeKey = messages.StringField(2)
+    error = messages.StringField(3)
+
+
+class ConferenceImportResults(messages.Message):
+    """ConferenceImportResults -- outcomes of a bulk import, in order"""
+    items = messages.MessageField(ConferenceImportResult, 1, repeated=True)
+
+
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm -- slim Conference outbound form message"""
+    name            = messages.StringField(1)
+    topics          = messages.StringField(2, repeated=True)
+    city            = messages.StringField(3)
+    startDate       = messages.StringField(4)
+    endDate         = messages.StringField(5)
+    maxAttendees    = messages.IntegerField(6, variant=messages.Variant.INT32)
+    seatsAvailable  = messages.IntegerField(7, variant=messages.Variant.INT32)
+    organizerDisplayName = messages.StringField(8)
+    websafeKey      = messages.StringField(9)
+
+class ConferenceSummaryForms(messages.Message):
+    """ConferenceSummaryForms -- multiple ConferenceSummary outbound form message"""
+    items = messages.MessageField(ConferenceSummaryForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
 
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
@@ -101,11 +255,18 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    cursor = messages.StringField(3)
 
 
 
 class Session(ndb.Model):
     """Session -- Session object"""
+    # sessions are read by key after keys-only queries; keep them in
+    # ndb's memcache entity cache
+    _use_memcache = True
+    _memcache_timeout = 60 * 60
+
     name            = ndb.StringProperty(required=True)
     highlights      = ndb.StringProperty(repeated=True)
     speaker         = ndb.StringProperty()
@@ -114,6 +275,41 @@ class Session(ndb.Model):
     date            = ndb.DateProperty()
     startTime       = ndb.TimeProperty()
 
+class Speaker(ndb.Model):
+    """Speaker -- Session keys of one speaker, keyed by normalised name"""
+    name            = ndb.StringProperty(indexed=False)
+    sessionKeys     = ndb.KeyProperty(kind="Session", repeated=True,
+                                      indexed=False)
+
+    @staticmethod
+    def normalise(name):
+        """Fold case and whitespace so lookups are case-insensitive."""
+        return ' '.join((name or '').split()).lower()
+
+    @classmethod
+    def keyFor(cls, name):
+        return ndb.Key(cls, cls.normalise(name))
+
+class FeaturedSpeaker(ndb.Model):
+    """FeaturedSpeaker -- speaker tally of a Conference, its child"""
+    # speaker -> names of their sessions, in creation order
+    sessionNames    = ndb.JsonProperty(compressed=True)
+    speaker         = ndb.StringProperty(indexed=False)
+
+    @classmethod
+    def keyFor(cls, c_key):
+        """Tallies are single children of their Conference."""
+        return ndb.Key(cls, 1, parent=c_key)
+
+class AgendaSnapshot(ndb.Model):
+    """AgendaSnapshot -- serialised sessions of a Conference, its child"""
+    agenda          = ndb.JsonProperty(compressed=True)
+
+    @classmethod
+    def keyFor(cls, c_key):
+        """Snapshots are single children of their Conference."""
+        return ndb.Key(cls, 1, parent=c_key)
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
     name                        = messages.StringField(1)
@@ -130,6 +326,13 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+
+
+class WishlistUpdateForm(messages.Message):
+    """WishlistUpdateForm -- sessions to add to/remove from the wishlist"""
+    addSessionKeys              = messages.StringField(1, repeated=True)
+    removeSessionKeys           = messages.StringField(2, repeated=True)
 
 
 # needed for conference registration
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""
+query_planner.py -- picks a composite index from index.yaml for
+    conference queries, leaving uncovered predicates to be filtered
+    in memory, and records the query shapes that needed that
+
+"""
+
+import os
+
+import yaml
+from google.appengine.api import memcache
+
+
+INDEX_YAML = os.path.join(os.path.dirname(__file__), 'index.yaml')
+MEMCACHE_SHAPES_KEY = "QUERY_SHAPES"
+MEMCACHE_SHAPE_PREFIX = "QUERY_SHAPE:"
+# operators never pushed down to the datastore
+NOT_PUSHED = ('!=',)
+
+
+class QueryPlanner(object):
+    """Split query filters between a composite index and post-filters.
+
+    Queries are assumed to be sorted on their inequality field (if any
+    filter is pushed down on it) and then on sort_property, which is
+    what index.yaml has to provide for them.
+
+    '!=' filters are always left to be filtered in memory: ndb runs
+    them as two queries, which cannot be paged with cursors unless
+    they are ordered by key.
+    """
+
+    def __init__(self, kind, sort_property, index_path=INDEX_YAML):
+        self.kind = kind
+        self.sort_property = sort_property
+        self.indexes = self._loadIndexes(index_path)
+
+    def _loadIndexes(self, index_path):
+        """Return property name lists of the kind's composite indexes."""
+        with open(index_path) as f:
+            config = yaml.safe_load(f) or {}
+        return [
+            [prop['name'] for prop in index.get('properties', [])]
+            for index in config.get('indexes') or []
+            if index.get('kind') == self.kind
+            and not index.get('ancestor')
+        ]
+
+    def plan(self, filters):
+        """Return (datastore_filters, post_filters, inequality_field).
+
+        The index chosen is the one able to serve the most filters;
+        inequality_field is the field to sort on first, or None.
+        """
+        equality_fields = set(
+            f["field"] for f in filters if f["operator"] == "=")
+        inequality_fields = set(
+            f["field"] for f in filters if f["operator"] not in NOT_PUSHED
+            and f["operator"] != "=")
+
+        # sorting on sort_property alone is served by the built-in index
+        best = (0, set(), None)
+        for props in self.indexes:
+            if not props or props[-1] != self.sort_property:
+                continue
+            body = props[:-1]
+            inequality_field = None
+            if body and body[-1] in inequality_fields \
+                    and len(inequality_fields) == 1:
+                inequality_field = body.pop()
+            if not set(body) <= equality_fields:
+                continue
+            served = sum(
+                1 for f in filters
+                if (f["operator"] == "=" and f["field"] in body)
+                or (f["field"] == inequality_field
+                    and f["operator"] not in NOT_PUSHED)
+            )
+            if served > best[0]:
+                best = (served, set(body), inequality_field)
+
+        served, index_fields, inequality_field = best
+        pushed, post = [], []
+        for f in filters:
+            if f["operator"] in NOT_PUSHED:
+                post.append(f)
+            elif (f["operator"] == "=" and f["field"] in index_fields) \
+                    or f["field"] == inequality_field:
+                pushed.append(f)
+            else:
+                post.append(f)
+        return pushed, post, inequality_field
+
+    @staticmethod
+    def shape(filters):
+        """Return the index properties a query shape needs, as a tuple."""
+        equality = sorted(set(
+            f["field"] for f in filters if f["operator"] == "="))
+        inequality = sorted(set(
+            f["field"] for f in filters if f["operator"] not in NOT_PUSHED
+            and f["operator"] != "="))
+        return tuple(equality + inequality[:1])
+
+    def recordSlowShape(self, filters, scanned):
+        """Count a query shape that had to be filtered in memory."""
+        shape = ','.join(self.shape(filters))
+        client = memcache.Client()
+        # register the shape once, then count it with atomic increments
+        for _ in range(3):
+            shapes = client.gets(MEMCACHE_SHAPES_KEY)
+            if shapes is None:
+                if client.add(MEMCACHE_SHAPES_KEY, [shape]):
+                    break
+                continue
+            if shape in shapes or client.cas(
+                    MEMCACHE_SHAPES_KEY, shapes + [shape]):
+                break
+        memcache.incr(MEMCACHE_SHAPE_PREFIX + shape + ':count',
+                      initial_value=0)
+        memcache.incr(MEMCACHE_SHAPE_PREFIX + shape + ':scanned',
+                      delta=scanned, initial_value=0)
+
+    def suggestions(self):
+        """Return index.yaml snippets for observed slow query shapes.
+
+        Shapes are ordered by how many rows they made us scan.
+        """
+        shapes = memcache.get(MEMCACHE_SHAPES_KEY) or []
+        stats = memcache.get_multi(
+            [s + suffix for s in shapes
+             for suffix in (':count', ':scanned')],
+            key_prefix=MEMCACHE_SHAPE_PREFIX
+        )
+        advice = []
+        for shape in shapes:
+            props = [p for p in shape.split(',') if p]
+            if props + [self.sort_property] in self.indexes:
+                continue
+            advice.append((
+                int(stats.get(shape + ':scanned') or 0),
+                int(stats.get(shape + ':count') or 0),
+                props
+            ))
+        advice.sort(reverse=True)
+        return [
+            {
+                'queries': count,
+                'scanned': scanned,
+                'index': {
+                    'kind': self.kind,
+                    'properties': [
+                        {'name': p} for p in props + [self.sort_property]
+                    ],
+                },
+            } for scanned, count, props in advice
+        ]
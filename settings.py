@@ -16,3 +16,7 @@ WEB_CLIENT_ID = 'YOUR CLIENT ID'
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Confirmation emails sent per second by the mail worker; keep this
+# under the app's mail quota.
+CONFIRMATION_EMAIL_RATE = 5
@@ -293,6 +293,12 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.conferences = [];
 
+    /**
+     * Holds the cursor for the next page of queryConferenceSummaries results.
+     * @type {string}
+     */
+    $scope.nextCursor = null;
+
     /**
      * Holds the state if offcanvas is enabled.
      *
@@ -414,6 +420,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.nextCursor = null;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -424,11 +431,15 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Invokes the conference.queryConferenceSummaries API.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (cursor) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.pagination.pageSize
+        }
+        if (cursor) {
+            sendFilters.cursor = cursor;
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -441,7 +452,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
+        gapi.client.conference.queryConferenceSummaries(sendFilters).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -458,10 +469,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!cursor) {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextCursor = resp.nextCursor || null;
                     }
                     $scope.submitted = true;
                 });
@@ -469,11 +483,20 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     }
 
     /**
-     * Invokes the conference.getConferencesCreated method.
+     * Fetches the next page of the conference.queryConferenceSummaries results.
+     */
+    $scope.loadMoreConferences = function () {
+        if ($scope.nextCursor) {
+            $scope.queryConferencesAll($scope.nextCursor);
+        }
+    };
+
+    /**
+     * Invokes the conference.getConferenceSummariesCreated method.
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        gapi.client.conference.getConferenceSummariesCreated().
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
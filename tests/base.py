@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+base.py -- shared testbed setup for the conference API tests
+
+Run from the repository root with the App Engine SDK importable:
+
+    python -m unittest discover -s tests -t .
+
+"""
+
+import collections
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+except ImportError:
+    # the SDK's libraries are already on sys.path
+    pass
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import conference
+from conference import ConferenceApi
+
+
+class RpcCounter(object):
+    """Count API calls per (service, method) through a pre-call hook."""
+
+    def __init__(self, service='datastore_v3'):
+        self.service = service
+        self.calls = collections.Counter()
+
+    def _count(self, service, call, request, response):
+        self.calls[call] += 1
+
+    def install(self):
+        # hooks are checked with inspect.getargspec, which rejects
+        # callable instances; register the bound method instead
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'rpc_counter_%s' % self.service, self._count, self.service)
+        return self
+
+    def reset(self):
+        self.calls.clear()
+
+
+class ConferenceTestCase(unittest.TestCase):
+    """Testbed with every stub the API uses and a signed-in user."""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # strongly consistent, so tests need not wait for queries
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.testbed.init_mail_stub()
+        self.mail = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_user_stub()
+        self.testbed.init_urlfetch_stub()
+        ndb.get_context().clear_cache()
+        conference.ORGANIZER_NAMES.clear()
+        self.rpcs = None
+
+        self._get_current_user = endpoints.get_current_user
+        endpoints.get_current_user = lambda: self.user
+        self.login('organizer@example.com')
+
+    def tearDown(self):
+        endpoints.get_current_user = self._get_current_user
+        self.testbed.deactivate()
+
+    def login(self, email):
+        """Act as email from now on, in a fresh request."""
+        # a new request starts with an empty ndb context cache
+        ndb.get_context().clear_cache()
+        self.user = users.User(email)
+        self.api = ConferenceApi()
+
+    def countRpcs(self):
+        """Start counting datastore RPCs from zero; return the counter."""
+        # hooks are deduplicated by key, so a second install would be
+        # silently ignored; install once per test and reset after that
+        if self.rpcs is None:
+            self.rpcs = RpcCounter().install()
+        self.rpcs.reset()
+        return self.rpcs
+
+    def coldCaches(self):
+        """Forget everything cached, as a new instance would."""
+        ndb.get_context().clear_cache()
+        memcache.flush_all()
+        conference.ORGANIZER_NAMES.clear()
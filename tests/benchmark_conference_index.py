@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+benchmark_conference_index.py -- multi-inequality conference queries,
+    in-memory index vs the datastore query plus in-memory filtering
+
+    python tests/benchmark_conference_index.py
+
+"""
+
+import random
+import time
+import unittest
+
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+import conference
+from conference import CONFERENCE_INDEX
+from conference_index import ConferenceIndex
+from models import Conference
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+
+CONFERENCES = 5000
+RUNS = 5
+CITIES = ('London', 'Paris', 'Berlin', 'Tokyo', 'Chicago')
+TOPICS = ('Web', 'Mobile', 'Cloud', 'Data', 'Security')
+
+
+class ConferenceIndexBenchmark(ConferenceTestCase):
+
+    def setUp(self):
+        super(ConferenceIndexBenchmark, self).setUp()
+        rnd = random.Random(42)
+        confs = []
+        for i in range(CONFERENCES):
+            seats = rnd.randint(10, 500)
+            confs.append(Conference(
+                name='Conference %05d' % i, city=rnd.choice(CITIES),
+                topics=rnd.sample(TOPICS, 2), month=rnd.randint(1, 12),
+                maxAttendees=seats, seatsAvailable=rnd.randint(0, seats)))
+        ndb.put_multi(confs)
+        CONFERENCE_INDEX._snapshot = None
+        self.coldCaches()
+
+    def request(self, filters):
+        return ConferenceQueryForms(
+            filters=[
+                ConferenceQueryForm(field=f, operator=o, value=v)
+                for f, o, v in filters
+            ],
+            pageSize=conference.MAX_PAGE_SIZE)
+
+    def viaIndex(self, request):
+        keys = []
+        filters = self.api._parseFilters(request.filters)
+        while True:
+            confs, cursor = self.api._searchIndex(request, filters)
+            keys.extend(conf.key for conf in confs)
+            if not cursor:
+                return keys
+            request.cursor = cursor
+
+    def viaDatastore(self, request):
+        # the datastore serves the first inequality; the rest is
+        # filtered in memory, as before the index existed
+        filters = self.api._parseFilters(request.filters)
+        first = filters[0]
+        q = Conference.query(ndb.query.FilterNode(
+            first["field"], first["operator"], first["value"]))
+        q = q.order(ndb.GenericProperty(first["field"]), Conference.name)
+        return [
+            conf.key for conf in q
+            if ConferenceIndex.matches(conf, filters[1:])
+        ]
+
+    def timed(self, fn, filters):
+        results, elapsed = None, []
+        for _ in range(RUNS):
+            ndb.get_context().clear_cache()
+            started = time.time()
+            results = fn(self.request(filters))
+            elapsed.append((time.time() - started) * 1000)
+        return results, min(elapsed)
+
+    def testMultiInequalityQueries(self):
+        started = time.time()
+        CONFERENCE_INDEX.refresh()
+        print('index build over %d conferences: %.1f ms'
+              % (CONFERENCES, (time.time() - started) * 1000))
+
+        for filters in (
+            [('MONTH', 'GT', '5'), ('MAX_ATTENDEES', 'LT', '100')],
+            [('MONTH', 'LTEQ', '3'), ('MAX_ATTENDEES', 'GTEQ', '250'),
+             ('TOPIC', 'EQ', 'Cloud')],
+            [('MAX_ATTENDEES', 'GT', '50'), ('CITY', 'NE', 'London'),
+             ('MONTH', 'NE', '6')],
+        ):
+            index_keys, index_ms = self.timed(self.viaIndex, filters)
+            store_keys, store_ms = self.timed(self.viaDatastore, filters)
+            self.assertEqual(set(index_keys), set(store_keys))
+            print('%-60s %5d rows  index %7.1f ms  datastore %7.1f ms'
+                  % (' AND '.join(' '.join(f) for f in filters),
+                     len(index_keys), index_ms, store_ms))
+
+
+if __name__ == '__main__':
+    unittest.main()
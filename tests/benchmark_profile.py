@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+benchmark_profile.py -- Profile membership checks on large profiles,
+    set-backed access layer vs scanning the repeated properties
+
+    python tests/benchmark_profile.py
+
+"""
+
+import time
+import unittest
+
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+from models import Profile
+
+SIZES = (1000, 5000)
+OPERATIONS = 1000
+
+
+def timed(fn):
+    started = time.time()
+    result = fn()
+    return result, (time.time() - started) * 1000
+
+
+class ProfileMembershipBenchmark(ConferenceTestCase):
+
+    def makeProfile(self, size):
+        p_key = ndb.Key(Profile, 'power@example.com')
+        conf_keys = [
+            ndb.Key('Conference', i + 1, parent=p_key) for i in range(size)]
+        session_keys = [
+            ndb.Key('Session', i + 1, parent=conf_keys[i % len(conf_keys)])
+            for i in range(size)]
+        Profile(
+            key=p_key, displayName='Power User',
+            conferenceKeysToAttend=[k.urlsafe() for k in conf_keys],
+            wishlist=session_keys).put()
+        ndb.get_context().clear_cache()
+        return p_key, conf_keys, session_keys
+
+    def benchmark(self, size):
+        p_key, conf_keys, session_keys = self.makeProfile(size)
+        # probe the tail, where a linear scan is slowest, plus misses
+        probes = session_keys[-OPERATIONS // 2:] + [
+            ndb.Key('Session', size + i + 1, parent=conf_keys[0])
+            for i in range(OPERATIONS // 2)]
+        conf_probes = [k.urlsafe() for k in conf_keys[-OPERATIONS:]]
+
+        def scanning():
+            prof = p_key.get(use_cache=False)
+            hits = sum(1 for k in probes if k in prof.wishlist)
+            hits += sum(
+                1 for k in conf_probes if k in prof.conferenceKeysToAttend)
+            for k in probes:
+                if k in prof.wishlist:
+                    prof.wishlist.remove(k)
+                else:
+                    prof.wishlist.append(k)
+            return hits, sorted(prof.wishlist)
+
+        def layered():
+            prof = p_key.get(use_cache=False)
+            hits = sum(1 for k in probes if prof.isInWishlist(k))
+            hits += sum(1 for k in conf_probes if prof.isAttending(k))
+            for k in probes:
+                if not prof.removeFromWishlist(k):
+                    prof.addToWishlist(k)
+            # write back through _pre_put_hook, as a request would
+            prof._pre_put_hook()
+            return hits, sorted(prof.wishlist)
+
+        expected, scan_ms = timed(scanning)
+        result, layer_ms = timed(layered)
+        self.assertEqual(result, expected)
+        print('%5d entries: scanning %8.1f ms  access layer %6.1f ms'
+              % (size, scan_ms, layer_ms))
+        return scan_ms, layer_ms
+
+    def testLargeProfiles(self):
+        for size in SIZES:
+            scan_ms, layer_ms = self.benchmark(size)
+            self.assertLess(layer_ms, scan_ms)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+benchmark_seats.py -- registration contention, Conference entity vs
+    seat shards, on the testbed datastore stub
+
+Registrants run on concurrent threads against one conference; every
+commit beyond one per registration is a transaction retried after a
+collision.
+
+    python tests/benchmark_seats.py
+
+"""
+
+import collections
+import threading
+import time
+import unittest
+
+import endpoints
+from google.appengine.api import users
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+from base import RpcCounter
+import conference
+from conference import ConferenceApi
+from conference import CONF_GET_REQUEST
+from models import Conference
+from models import ConferenceForm
+
+THREADS = 10
+REGISTRATIONS_PER_THREAD = 20
+
+
+class LockedRpcCounter(RpcCounter):
+    """RpcCounter that can be shared by threads."""
+
+    def __init__(self):
+        super(LockedRpcCounter, self).__init__()
+        self._lock = threading.Lock()
+
+    def _count(self, service, call, request, response):
+        with self._lock:
+            self.calls[call] += 1
+
+
+class SeatContentionBenchmark(ConferenceTestCase):
+
+    def setUp(self):
+        super(SeatContentionBenchmark, self).setUp()
+        # each registrant thread signs in as its own user
+        self.local = threading.local()
+        endpoints.get_current_user = lambda: self.local.user
+        # hooks are deduplicated by key; install once, reset per run
+        self.rpcs = LockedRpcCounter().install()
+
+    def run_registrations(self, max_attendees):
+        self.local.user = users.User('organizer@example.com')
+        ConferenceApi().createConference(ConferenceForm(
+            name='Conference %d' % max_attendees,
+            maxAttendees=max_attendees))
+        conf = Conference.query(
+            Conference.maxAttendees == max_attendees).get()
+        request = CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=conf.key.urlsafe())
+
+        outcomes = collections.Counter()
+        lock = threading.Lock()
+
+        def registrant(n):
+            for i in range(REGISTRATIONS_PER_THREAD):
+                self.local.user = users.User(
+                    'user%d-%d@example.com' % (n, i))
+                try:
+                    ConferenceApi().registerForConference(request)
+                    outcome = 'registered'
+                except Exception as e:
+                    outcome = type(e).__name__
+                with lock:
+                    outcomes[outcome] += 1
+
+        rpcs = self.rpcs
+        rpcs.reset()
+        threads = [
+            threading.Thread(target=registrant, args=(n,))
+            for n in range(THREADS)
+        ]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        # every seat taken is held by exactly one registrant
+        ndb.get_context().clear_cache()
+        if conf.seatShards:
+            seats = sum(shard.seatsAvailable for shard in ndb.get_multi(
+                ConferenceApi._seatShardKeys(conf.key, conf.seatShards)))
+        else:
+            seats = conf.key.get().seatsAvailable
+        self.assertEqual(max_attendees - seats, outcomes['registered'])
+
+        registered = outcomes['registered'] or 1
+        print('%-8s %6.1f ms/registration  %4.2f commits/registration  %s'
+              % ('sharded' if conf.seatShards else 'entity',
+                 elapsed * 1000 / registered,
+                 float(rpcs.calls['Commit']) / registered,
+                 dict(outcomes)))
+        return outcomes, dict(rpcs.calls)
+
+    def testContention(self):
+        total = THREADS * REGISTRATIONS_PER_THREAD
+        entity, _ = self.run_registrations(
+            conference.SHARDED_SEATS_MIN_ATTENDEES - 1)
+        sharded, _ = self.run_registrations(
+            conference.SHARDED_SEATS_MIN_ATTENDEES)
+        self.assertEqual(sum(entity.values()), total)
+        self.assertEqual(sharded['registered'], total)
+
+
+if __name__ == '__main__':
+    unittest.main()
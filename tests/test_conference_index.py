@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+test_conference_index.py -- the in-memory index of Conference fields
+
+"""
+
+import unittest
+
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+from conference_index import ConferenceIndex
+from models import Conference
+
+
+class ConferenceIndexTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(ConferenceIndexTest, self).setUp()
+        self.keys = dict(zip('cab', ndb.put_multi([
+            Conference(name='c', city='Paris', topics=['Web', 'Data'],
+                       month=3, maxAttendees=50),
+            Conference(name='a', city='London', topics=['Web'],
+                       month=6, maxAttendees=500),
+            # no city, topics or month
+            Conference(name='b', maxAttendees=10),
+        ])))
+        self.coldCaches()
+        self.index = ConferenceIndex()
+
+    def search(self, *filters):
+        return self.index.search([
+            {'field': f, 'operator': o, 'value': v} for f, o, v in filters
+        ])
+
+    def names(self, keys):
+        return ''.join(
+            name for key in keys
+            for name, k in self.keys.items() if k == key)
+
+    def testRowsAreInNameOrder(self):
+        self.assertEqual(self.names(self.search()), 'abc')
+
+    def testEveryFieldIsIndexed(self):
+        self.assertEqual(self.names(self.search(
+            ('month', '>', 1), ('maxAttendees', '<', 100))), 'c')
+        self.assertEqual(self.names(self.search(('topics', '=', 'Web'))),
+                         'ac')
+        self.assertEqual(self.names(self.search(('topics', '=', 'Data'))),
+                         'c')
+        self.assertEqual(self.names(self.search(('city', '=', 'London'))),
+                         'a')
+
+    def testMissingValuesCompareLikeDatastoreNulls(self):
+        # nulls sort before every number
+        self.assertEqual(self.names(self.search(('month', '<', 12))), 'abc')
+        self.assertEqual(self.names(self.search(('month', '>', 1))), 'ac')
+        self.assertEqual(self.names(self.search(('city', '!=', 'Paris'))),
+                         'ab')
+
+    def testBuildSkipsTheCaches(self):
+        rpcs = self.countRpcs()
+        self.index.refresh()
+        self.assertEqual(rpcs.calls['Get'], 0)
+        self.assertEqual(ndb.get_context()._cache, {})
+
+    def testStaleSnapshotIsServedWhileRebuilding(self):
+        stale = self.index._getSnapshot()
+        stale['built'] -= self.index.refresh_interval
+        # the rebuild is under way in another thread
+        self.index._lock.acquire()
+        try:
+            self.assertIs(self.index._getSnapshot(), stale)
+        finally:
+            self.index._lock.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
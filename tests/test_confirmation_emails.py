@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""
+test_confirmation_emails.py -- rate-limited sending of queued
+    confirmation emails, with retries
+
+"""
+
+import json
+import time
+import unittest
+
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+import conference
+from conference import ConferenceApi
+from models import Conference
+
+EMAIL = 'organizer@example.com'
+
+
+class FakeClock(object):
+    """Stand-in for the time module; sleeping moves the clock on."""
+
+    def __init__(self):
+        self.now = time.time()
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ConfirmationEmailTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(ConfirmationEmailTest, self).setUp()
+        self.clock = FakeClock()
+        self.patch(conference, 'time', self.clock)
+        self.leases = 0
+        lease_tasks = taskqueue.Queue.lease_tasks
+
+        def counted(queue, *args, **kwargs):
+            self.leases += 1
+            return lease_tasks(queue, *args, **kwargs)
+        self.patch(taskqueue.Queue, 'lease_tasks', counted)
+
+    def patch(self, obj, name, value):
+        self.addCleanup(setattr, obj, name, getattr(obj, name))
+        setattr(obj, name, value)
+
+    def queueConferences(self, count):
+        c_keys = ndb.put_multi([
+            Conference(name='Conference %d' % i, city='London',
+                       topics=['Web'], maxAttendees=100)
+            for i in range(count)
+        ])
+        ConferenceApi._queueConfirmationEmails(EMAIL, c_keys)
+        return c_keys
+
+    def queueEmail(self, attempts):
+        c_key = Conference(name='Conference').put()
+        taskqueue.Queue(conference.CONFIRMATION_EMAIL_QUEUE).add(
+            ConferenceApi._confirmationEmailTask({
+                'email': EMAIL,
+                'websafeConferenceKey': c_key.urlsafe(),
+                'attempts': attempts,
+            }))
+
+    def failSends(self):
+        def send_mail(*args, **kwargs):
+            raise mail.Error('unavailable')
+        self.patch(mail, 'send_mail', send_mail)
+
+    def send(self, seconds, rate=10):
+        ConferenceApi._sendConfirmationEmails(
+            self.clock.now + seconds, rate=rate)
+
+    def sent(self):
+        return self.mail.get_sent_messages(to=EMAIL)
+
+    def queued(self):
+        return [json.loads(task.payload)
+                for task in self.taskqueue.get_filtered_tasks(
+                    queue_names=conference.CONFIRMATION_EMAIL_QUEUE)]
+
+    def testSendsTheRenderedEmail(self):
+        self.queueConferences(1)
+        self.send(60)
+
+        messages = self.sent()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].subject,
+                         conference.CONFIRMATION_EMAIL_SUBJECT)
+        body = messages[0].body.decode()
+        self.assertIn('Name: Conference 0', body)
+        self.assertIn('City: London', body)
+        self.assertEqual(self.queued(), [])
+
+    def testLeasesNoMoreThanTheRateAllowsBeforeTheDeadline(self):
+        self.queueConferences(10)
+        self.send(3, rate=2)
+
+        # six sends fit in three seconds at two a second
+        self.assertEqual(len(self.sent()), 6)
+        self.assertEqual(self.clock.sleeps, [0.5] * 6)
+        self.assertEqual(self.leases, 1)
+        self.assertEqual(len(self.queued()), 4)
+
+    def testFailedSendIsRequeuedWithBackoff(self):
+        self.queueConferences(1)
+        self.failSends()
+        self.send(60)
+
+        tasks = self.taskqueue.get_filtered_tasks(
+            queue_names=conference.CONFIRMATION_EMAIL_QUEUE)
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(json.loads(tasks[0].payload)['attempts'], 1)
+        self.assertGreater(tasks[0].eta_posix,
+                           time.time() + conference.CONFIRMATION_EMAIL_BACKOFF
+                           - 5)
+        # the retry is not due yet, so the same run did not lease it again
+        self.assertEqual(self.leases, 2)
+
+    def testBackoffDoublesWithEachAttempt(self):
+        self.queueEmail(attempts=2)
+        self.failSends()
+        self.send(60)
+
+        tasks = self.taskqueue.get_filtered_tasks(
+            queue_names=conference.CONFIRMATION_EMAIL_QUEUE)
+        self.assertEqual(json.loads(tasks[0].payload)['attempts'], 3)
+        self.assertGreater(tasks[0].eta_posix,
+                           time.time()
+                           + 4 * conference.CONFIRMATION_EMAIL_BACKOFF - 5)
+
+    def testDroppedAfterMaxAttempts(self):
+        self.queueEmail(
+            attempts=conference.CONFIRMATION_EMAIL_MAX_ATTEMPTS - 1)
+        self.failSends()
+        self.send(60)
+
+        self.assertEqual(self.sent(), [])
+        self.assertEqual(self.queued(), [])
+
+    def testSlowSendsStopAtTheDeadline(self):
+        self.queueConferences(5)
+        send_mail = mail.send_mail
+
+        def slow_send_mail(*args, **kwargs):
+            self.clock.now += 1
+            return send_mail(*args, **kwargs)
+        self.patch(mail, 'send_mail', slow_send_mail)
+        self.send(3)
+
+        self.assertEqual(len(self.sent()), 3)
+        self.assertEqual(self.leases, 1)
+        # the unsent two stay leased, their attempts untouched
+        self.assertEqual(
+            [item['attempts'] for item in self.queued()], [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
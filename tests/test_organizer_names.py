@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+test_organizer_names.py -- copying organiser names onto their conferences
+
+"""
+
+import unittest
+
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceSummary
+from models import Profile
+
+
+class OrganizerNameTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(OrganizerNameTest, self).setUp()
+        self.c_keys = {}
+        for user_id in ('a@example.com', 'b@example.com'):
+            p_key = ndb.Key(Profile, user_id)
+            Profile(key=p_key, displayName='Name of %s' % user_id,
+                    mainEmail=user_id).put()
+            confs = [
+                Conference(parent=p_key, name='Conference %d' % i,
+                           organizerUserId=user_id)
+                for i in range(30)
+            ]
+            self.c_keys[user_id] = ndb.put_multi(confs)
+            ndb.put_multi([
+                ConferenceSummary.fromConference(conf) for conf in confs])
+        self.coldCaches()
+
+    def names(self, user_id):
+        ndb.get_context().clear_cache()
+        c_keys = self.c_keys[user_id]
+        return set(
+            entity.organizerDisplayName for entity in ndb.get_multi(
+                c_keys + [ConferenceSummary.keyFor(k) for k in c_keys]))
+
+    def testUpdateWritesAnOrganizersConferencesInOneCommit(self):
+        rpcs = self.countRpcs()
+        cursor = ConferenceApi._updateOrganizerName('a@example.com')
+
+        self.assertIsNone(cursor)
+        self.assertEqual(rpcs.calls['Commit'], 1)
+        self.assertEqual(self.names('a@example.com'),
+                         set(['Name of a@example.com']))
+        self.assertEqual(self.names('b@example.com'), set([None]))
+
+    def testBackfillCommitsOncePerOrganizer(self):
+        named = self.c_keys['b@example.com'][0].get()
+        named.organizerDisplayName = 'Kept'
+        ndb.put_multi([named, ConferenceSummary.fromConference(named)])
+        self.coldCaches()
+
+        rpcs = self.countRpcs()
+        cursor = ConferenceApi._backfillOrganizerNames()
+
+        self.assertIsNone(cursor)
+        self.assertEqual(rpcs.calls['Commit'], 2)
+        self.assertEqual(self.names('a@example.com'),
+                         set(['Name of a@example.com']))
+        self.assertEqual(self.names('b@example.com'),
+                         set(['Name of b@example.com', 'Kept']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+test_profile_unit_of_work.py -- datastore RPCs made for the request's
+    Profile
+
+"""
+
+import unittest
+
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+from conference import CONF_GET_REQUEST
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileMiniForm
+from models import TeeShirtSize
+
+
+class ProfileUnitOfWorkTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(ProfileUnitOfWorkTest, self).setUp()
+        self.login('user@example.com')
+        self.coldCaches()
+
+    def stored(self):
+        ndb.get_context().clear_cache()
+        return ndb.Key(Profile, 'user@example.com').get()
+
+    def testNewProfileIsReadOnceAndPutOnce(self):
+        rpcs = self.countRpcs()
+        self.api.getProfile(None)
+        self.api.getProfile(None)
+
+        self.assertEqual(rpcs.calls['Get'], 1)
+        self.assertEqual(rpcs.calls['Put'], 1)
+        self.assertEqual(self.stored().displayName, self.user.nickname())
+
+    def testSaveWritesEveryChangedFieldInOnePut(self):
+        self.api.getProfile(None)
+        self.login('user@example.com')
+        rpcs = self.countRpcs()
+        form = self.api.saveProfile(ProfileMiniForm(
+            displayName='New Name', teeShirtSize=TeeShirtSize.XS_M))
+
+        self.assertEqual(rpcs.calls['Get'], 1)
+        self.assertEqual(rpcs.calls['Put'], 1)
+        self.assertEqual(form.displayName, 'New Name')
+        prof = self.stored()
+        self.assertEqual(prof.displayName, 'New Name')
+        self.assertEqual(prof.teeShirtSize, 'XS_M')
+        self.assertEqual(len(self.taskqueue.get_filtered_tasks(
+            url='/tasks/update_organizer_name')), 1)
+
+    def testUnchangedSaveDoesNotPut(self):
+        self.api.saveProfile(ProfileMiniForm(displayName='Name'))
+        self.login('user@example.com')
+        rpcs = self.countRpcs()
+        self.api.saveProfile(ProfileMiniForm(displayName='Name'))
+
+        self.assertEqual(rpcs.calls['Put'], 0)
+        self.assertEqual(len(self.taskqueue.get_filtered_tasks(
+            url='/tasks/update_organizer_name')), 1)
+
+    def testTransactionDropsTheCachedProfile(self):
+        self.login('organizer@example.com')
+        self.api.createConference(ConferenceForm(
+            name='Conference', maxAttendees=10))
+        c_key = Conference.query().get().key
+        self.login('user@example.com')
+        self.api.getProfile(None)
+        self.assertIsNotNone(self.api._profile)
+
+        self.api.registerForConference(
+            CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=c_key.urlsafe()))
+
+        # the transaction wrote its own copy of the profile
+        self.assertIsNone(self.api._profile)
+        rpcs = self.countRpcs()
+        form = self.api.getProfile(None)
+        self.assertEqual(rpcs.calls['Put'], 0)
+        self.assertEqual(form.conferenceKeysToAttend, [c_key.urlsafe()])
+        self.assertTrue(self.stored().isAttending(c_key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+test_query_conferences.py -- datastore RPCs made by queryConferences
+
+"""
+
+import unittest
+
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+from models import Profile
+
+
+class QueryConferencesRpcTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(QueryConferencesRpcTest, self).setUp()
+        # older conferences carry no organizerDisplayName, so listing
+        # them has to look the organisers up
+        entities = []
+        for i in range(5):
+            user_id = 'organizer%d@example.com' % i
+            p_key = ndb.Key(Profile, user_id)
+            entities.append(Profile(
+                key=p_key, displayName='Organizer %d' % i,
+                mainEmail=user_id))
+            for j in range(3):
+                entities.append(Conference(
+                    parent=p_key, name='Conference %d-%d' % (i, j),
+                    organizerUserId=user_id, city='London', month=6,
+                    maxAttendees=100, seatsAvailable=100))
+        ndb.put_multi(entities)
+        self.coldCaches()
+
+    def query(self, **kwargs):
+        return self.api.queryConferences(ConferenceQueryForms(**kwargs))
+
+    def testOneQueryAndOneOrganizerLookup(self):
+        rpcs = self.countRpcs()
+        forms = self.query()
+
+        self.assertEqual(len(forms.items), 15)
+        self.assertEqual(rpcs.calls['RunQuery'], 1)
+        self.assertEqual(rpcs.calls['Next'], 0)
+        # all five organisers in one get_multi
+        self.assertEqual(rpcs.calls['Get'], 1)
+        self.assertEqual(
+            set(form.organizerDisplayName for form in forms.items),
+            set('Organizer %d' % i for i in range(5)))
+
+    def testFilteredPageMakesTheSameRpcs(self):
+        rpcs = self.countRpcs()
+        forms = self.query(filters=[ConferenceQueryForm(
+            field='CITY', operator='EQ', value='London')], pageSize=4)
+
+        self.assertEqual(len(forms.items), 4)
+        self.assertTrue(forms.nextCursor)
+        self.assertEqual(rpcs.calls['RunQuery'], 1)
+        self.assertEqual(rpcs.calls['Get'], 1)
+
+    def testRepeatedQueryIsServedFromMemcache(self):
+        self.query()
+        ndb.get_context().clear_cache()
+        rpcs = self.countRpcs()
+        self.query()
+
+        self.assertEqual(sum(rpcs.calls.values()), 0)
+
+    def testSummaryPagesAreCachedUntilTheGenerationChanges(self):
+        request = ConferenceQueryForms(pageSize=4)
+        forms = self.api.queryConferenceSummaries(request)
+        ndb.get_context().clear_cache()
+        rpcs = self.countRpcs()
+        self.assertEqual(self.api.queryConferenceSummaries(request), forms)
+        self.assertEqual(sum(rpcs.calls.values()), 0)
+
+        # summaries are cached apart from the full forms of the query
+        self.assertEqual(len(self.query(pageSize=4).items), 4)
+        self.assertGreater(rpcs.calls['RunQuery'], 0)
+
+        ConferenceApi._bumpConferenceGeneration()
+        rpcs.reset()
+        self.api.queryConferenceSummaries(request)
+        self.assertEqual(rpcs.calls['RunQuery'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""
+test_registration_queue.py -- queued registrations for conferences
+    registered through the pull queue
+
+"""
+
+import time
+import unittest
+
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+import conference
+from conference import ConferenceApi
+from conference import CONF_GET_REQUEST
+from models import Conference
+from models import Profile
+
+
+class RegistrationQueueTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(RegistrationQueueTest, self).setUp()
+        # pick an id whose urlsafe key can also be spelled with padding
+        p_key = ndb.Key(Profile, 'organizer@example.com')
+        for i in range(1, 10):
+            c_key = ndb.Key(Conference, i, parent=p_key)
+            if len(c_key.urlsafe()) % 4:
+                break
+        Conference(key=c_key, name='Conference', maxAttendees=100,
+                   seatsAvailable=100, queuedRegistration=True).put()
+        self.wsck = c_key.urlsafe()
+        self.padded = self.wsck + '=' * (-len(self.wsck) % 4)
+        self.assertNotEqual(self.padded, self.wsck)
+
+    def request(self, wsck):
+        return CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=wsck)
+
+    def status(self, wsck):
+        return self.api.getRegistrationStatus(self.request(wsck)).data
+
+    def testKeySpellingsShareOneRegistration(self):
+        self.login('user@example.com')
+        self.assertTrue(
+            self.api.registerForConference(self.request(self.padded)).data)
+
+        self.assertEqual(self.status(self.wsck),
+                         conference.REGISTRATION_PENDING)
+        tasks = self.taskqueue.get_filtered_tasks(
+            queue_names=conference.REGISTRATION_QUEUE)
+        self.assertEqual([task.tag for task in tasks], [self.wsck])
+
+        ConferenceApi._processRegistrationQueue(time.time() + 10)
+        self.login('user@example.com')
+        self.assertEqual(self.status(self.padded),
+                         conference.REGISTRATION_REGISTERED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+test_seat_shards.py -- sharded seat allocation for large conferences
+
+"""
+
+import unittest
+
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+import conference
+from conference import ConferenceApi
+from conference import CONF_GET_REQUEST
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import SeatShard
+
+
+class SeatShardTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(SeatShardTest, self).setUp()
+        self.api.createConference(ConferenceForm(
+            name='Big Conference', maxAttendees=1000))
+        self.conf = Conference.query().get()
+        self.wsck = self.conf.key.urlsafe()
+
+    def shards(self):
+        ndb.get_context().clear_cache()
+        return ndb.get_multi(ConferenceApi._seatShardKeys(
+            self.conf.key, self.conf.seatShards))
+
+    def register(self, email, reg=True):
+        self.login(email)
+        request = CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=self.wsck)
+        if reg:
+            return self.api.registerForConference(request).data
+        return self.api.unregisterFromConference(request).data
+
+    def testShardsSumToMaxAttendees(self):
+        self.assertEqual(self.conf.seatShards, conference.SEAT_SHARDS)
+        shards = self.shards()
+        self.assertTrue(all(shards))
+        self.assertEqual(sum(s.seatsAvailable for s in shards), 1000)
+
+    def testRegistrationsComeOffTheShards(self):
+        for i in range(30):
+            self.assertTrue(self.register('user%d@example.com' % i))
+
+        self.assertEqual(sum(s.seatsAvailable for s in self.shards()), 970)
+        for i in range(30):
+            prof = ndb.Key(Profile, 'user%d@example.com' % i).get()
+            self.assertTrue(prof.isAttending(self.conf.key))
+
+    def testUnregisterReturnsTheSeat(self):
+        self.register('user@example.com')
+        self.assertTrue(self.register('user@example.com', reg=False))
+        self.assertFalse(self.register('user@example.com', reg=False))
+
+        self.assertEqual(sum(s.seatsAvailable for s in self.shards()), 1000)
+
+    def testFullShardsAreSkipped(self):
+        shards = self.shards()
+        for shard in shards[1:]:
+            shard.seatsAvailable = 0
+        ndb.put_multi(shards[1:])
+
+        self.assertTrue(self.register('user@example.com'))
+        self.assertEqual(
+            shards[0].seatsAvailable - 1, self.shards()[0].seatsAvailable)
+
+    def testRetriesOnAnotherShardWhenOneRunsOut(self):
+        self.login('user@example.com')
+        tried = []
+        shard_registration = self.api._shardRegistration
+
+        def drainFirst(wsck, shard_key, reg=True):
+            if not tried:
+                # another registrant takes the last seat of this shard
+                # between the read and the transaction
+                SeatShard(key=shard_key, seatsAvailable=0).put()
+            tried.append(shard_key)
+            return shard_registration(wsck, shard_key, reg)
+        self.api._shardRegistration = drainFirst
+
+        before = dict((s.key, s.seatsAvailable) for s in self.shards())
+        self.assertTrue(self.api.registerForConference(
+            CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck)).data)
+
+        self.assertEqual(len(tried), 2)
+        self.assertNotEqual(tried[0], tried[1])
+        self.assertEqual(before[tried[1]] - 1, tried[1].get().seatsAvailable)
+
+    def testSeatSyncIsCoalesced(self):
+        window = conference.SEAT_SYNC_WINDOW
+        # one window for the whole test, wherever the clock is
+        conference.SEAT_SYNC_WINDOW = 3600
+        try:
+            for i in range(5):
+                self.register('user%d@example.com' % i)
+        finally:
+            conference.SEAT_SYNC_WINDOW = window
+
+        tasks = self.taskqueue.get_filtered_tasks(url='/tasks/sync_seats')
+        self.assertEqual(len(tasks), 1)
+
+        ConferenceApi._syncSeatsAvailable(self.wsck)
+        self.assertEqual(self.conf.key.get().seatsAvailable, 995)
+
+
+if __name__ == '__main__':
+    unittest.main()
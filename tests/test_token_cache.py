@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+test_token_cache.py -- caching of OAuth token lookups against a stubbed
+    tokeninfo endpoint
+
+"""
+
+import json
+import time
+import unittest
+
+from google.appengine.api import apiproxy_stub
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import ndb
+
+from base import ConferenceTestCase
+import utils
+
+
+class FakeUrlFetch(apiproxy_stub.APIProxyStub):
+    """urlfetch stub answering every fetch with one canned response."""
+
+    def __init__(self):
+        super(FakeUrlFetch, self).__init__('urlfetch')
+        self.status, self.content = 200, ''
+        self.urls = []
+
+    def _Dynamic_Fetch(self, request, response):
+        self.urls.append(request.url())
+        response.set_statuscode(self.status)
+        response.set_content(self.content)
+
+
+class FakeClock(object):
+    """Stand-in for the time module that only moves when told to."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+class TokenCacheTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(TokenCacheTest, self).setUp()
+        self.urlfetch = FakeUrlFetch()
+        apiproxy_stub_map.apiproxy.ReplaceStub('urlfetch', self.urlfetch)
+        self.testbed.setup_env(
+            HTTP_AUTHORIZATION='Bearer token', overwrite=True)
+        self.clock = FakeClock()
+        self.patch(utils, 'time', self.clock)
+        # retries back off with ndb.sleep; do not wait in tests
+        sleep = ndb.sleep
+        self.patch(ndb, 'sleep', lambda seconds: sleep(0))
+        utils.TOKEN_USER_IDS.clear()
+
+    def patch(self, obj, name, value):
+        self.addCleanup(setattr, obj, name, getattr(obj, name))
+        setattr(obj, name, value)
+
+    def respond(self, status, content):
+        self.urlfetch.status, self.urlfetch.content = status, content
+
+    def valid(self, expires_in=3600):
+        self.respond(200, json.dumps(
+            {'user_id': '1234', 'expires_in': expires_in}))
+
+    def userId(self):
+        return utils.getOAuthUserIdAsync().get_result()
+
+    def newInstance(self):
+        utils.TOKEN_USER_IDS.clear()
+        ndb.get_context().clear_cache()
+
+    def testValidTokenIsCached(self):
+        self.valid()
+        self.assertEqual(self.userId(), '1234')
+        self.assertEqual(self.userId(), '1234')
+
+        self.assertEqual(len(self.urlfetch.urls), 1)
+
+    def testMemcacheHitMakesNoFetch(self):
+        self.valid()
+        self.userId()
+        self.newInstance()
+        self.respond(500, '')
+
+        self.assertEqual(self.userId(), '1234')
+        self.assertEqual(len(self.urlfetch.urls), 1)
+
+    def testTokenIsNotCachedPastItsExpiry(self):
+        self.valid(expires_in=30)
+        self.userId()
+        self.clock.now += 31
+        self.respond(200, json.dumps({'user_id': '5678'}))
+
+        self.assertEqual(self.userId(), '5678')
+        self.assertEqual(len(self.urlfetch.urls), 2)
+
+    def testLocalCopyKeepsTheRemainingLifetime(self):
+        self.valid(expires_in=30)
+        self.userId()
+        self.clock.now += 20
+        self.newInstance()
+        self.userId()
+        # memcache has ten seconds left; so does the copy taken from it
+        self.clock.now += 11
+        self.respond(200, json.dumps({'user_id': '5678'}))
+
+        self.assertEqual(self.userId(), '5678')
+        self.assertEqual(len(self.urlfetch.urls), 2)
+
+    def testInvalidTokenIsCachedBriefly(self):
+        self.respond(400, json.dumps({'error': 'invalid_token'}))
+        self.assertEqual(self.userId(), '')
+        fetches = len(self.urlfetch.urls)
+        self.assertEqual(self.userId(), '')
+        self.assertEqual(len(self.urlfetch.urls), fetches)
+
+        self.clock.now += utils.TOKEN_NEGATIVE_TTL + 1
+        self.newInstance()
+        self.valid()
+        self.assertEqual(self.userId(), '1234')
+
+    def testTransientFailureIsNotCached(self):
+        self.respond(500, '')
+        self.assertEqual(self.userId(), '')
+        self.assertEqual(len(self.urlfetch.urls), 3)
+
+        self.valid()
+        self.assertEqual(self.userId(), '1234')
+        self.assertEqual(len(self.urlfetch.urls), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+tiered_cache.py -- two-tier (instance memory, then memcache) cache for
+    small values that are read often and change rarely
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from utils import LRUCache
+
+
+LOCK_SUFFIX = ':refreshing'
+
+
+class TieredCache(object):
+    """Cache values per instance and in memcache, recomputing on miss.
+
+    Each entry is fresh for fresh_ttl seconds and may then be served
+    stale for up to stale_ttl more seconds. While an entry is stale, the
+    one request that wins a memcache lock recomputes it and every other
+    request keeps serving the stale value, so an expiry never causes a
+    burst of recomputes. Instances keep entries for at most local_ttl
+    seconds before checking memcache again.
+    """
+
+    def __init__(self, prefix, fresh_ttl, stale_ttl, local_ttl=10,
+                 capacity=1000, lock_ttl=30):
+        self.prefix = prefix
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.local_ttl = local_ttl
+        self.lock_ttl = lock_ttl
+        self._local = LRUCache(capacity, ttl=local_ttl)
+
+    def get(self, key, recompute):
+        """Return the value of key, calling recompute() if needed."""
+        key = self.prefix + key
+        entry = self._local.get(key)
+        if entry is None or entry[1] <= time.time():
+            # another instance may have refreshed it already
+            shared = memcache.get(key)
+            if shared is not None:
+                entry = shared
+                self._local.set(key, entry)
+        if entry is None:
+            # nothing to serve while recomputing
+            return self._store(key, recompute())
+
+        value, fresh_until = entry
+        if fresh_until <= time.time() and memcache.add(
+                key + LOCK_SUFFIX, 1, time=self.lock_ttl):
+            try:
+                value = self._store(key, recompute())
+            finally:
+                memcache.delete(key + LOCK_SUFFIX)
+        return value
+
+    def set(self, key, value):
+        """Store a freshly computed value."""
+        self._store(self.prefix + key, value)
+
+    def delete(self, key):
+        """Drop key from memcache and this instance.
+
+        Other instances may serve their copy for up to local_ttl seconds.
+        """
+        key = self.prefix + key
+        self._local.delete(key)
+        memcache.delete(key)
+
+    def _store(self, key, value):
+        entry = (value, time.time() + self.fresh_ttl)
+        self._local.set(key, entry)
+        memcache.set(key, entry, time=self.fresh_ttl + self.stale_ttl)
+        return value
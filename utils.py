@@ -1,38 +1,74 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
+from collections import OrderedDict
 
-from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
 from models import Profile
 
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+MEMCACHE_TOKEN_PREFIX = 'TOKEN_USER:'
+TOKEN_CACHE_TTL = 5 * 60
+TOKEN_NEGATIVE_TTL = 60
+
+
+class LRUCache(object):
+    """Thread-safe, size-bounded in-process cache.
+
+    Entries are evicted least-recently-used first once capacity is
+    reached, and expire after ttl seconds when a ttl is given.
+    """
+
+    def __init__(self, capacity, ttl=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.time():
+                return default
+            # re-insert to mark as most recently used
+            self._data[key] = (value, expires)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# user id ('' for rejected tokens) by hashed OAuth token
+TOKEN_USER_IDS = LRUCache(1000, ttl=TOKEN_CACHE_TTL)
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
 
     if id_type == "oauth":
         """A workaround implementation for getting userid."""
-        auth = os.getenv('HTTP_AUTHORIZATION')
-        bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return getOAuthUserIdAsync().get_result()
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
@@ -43,3 +79,70 @@ def getUserId(user, id_type="email"):
             return profile.id()
         else:
             return str(uuid.uuid1().get_hex())
+
+
+@ndb.tasklet
+def getOAuthUserIdAsync():
+    """Resolve the request's bearer token to a user id.
+
+    Results are cached by token in-process and in memcache, with the
+    time they expire; tokens that tokeninfo rejects are cached too, for
+    TOKEN_NEGATIVE_TTL seconds.
+    """
+    auth = os.getenv('HTTP_AUTHORIZATION')
+    bearer, token = auth.split()
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+
+    # hash the token so raw credentials never end up as cache keys
+    cache_key = MEMCACHE_TOKEN_PREFIX + hashlib.sha256(token).hexdigest()
+    user_id = TOKEN_USER_IDS.get(cache_key)
+    if user_id is not None:
+        raise ndb.Return(user_id)
+
+    ctx = ndb.get_context()
+    cached = yield ctx.memcache_get(cache_key)
+    if cached is not None:
+        # keep the local copy no longer than the token has left
+        user_id, expires = cached
+        ttl = expires - time.time()
+        if ttl > 0:
+            TOKEN_USER_IDS.set(cache_key, user_id, ttl=ttl)
+            raise ndb.Return(user_id)
+
+    user, ttl = yield _fetchTokenInfoAsync(token, token_type)
+    user_id = user.get('user_id', '')
+    if ttl:
+        TOKEN_USER_IDS.set(cache_key, user_id, ttl=ttl)
+        yield ctx.memcache_set(
+            cache_key, (user_id, time.time() + ttl), time=ttl)
+    raise ndb.Return(user_id)
+
+
+@ndb.tasklet
+def _fetchTokenInfoAsync(token, token_type):
+    """Call tokeninfo; return (token info, seconds it may be cached).
+
+    The cache time is None after transient failures, which should not
+    be remembered.
+    """
+    ctx = ndb.get_context()
+    url = TOKENINFO_URL % (token_type, token)
+    wait = 1
+    ttl = None
+    for i in range(3):
+        resp = yield ctx.urlfetch(url)
+        if resp.status_code == 200:
+            user = json.loads(resp.content)
+            expires_in = int(user.get('expires_in', TOKEN_CACHE_TTL))
+            raise ndb.Return((user, min(expires_in, TOKEN_CACHE_TTL)))
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            url = TOKENINFO_URL % ('access_token', token)
+            ttl = TOKEN_NEGATIVE_TTL
+        else:
+            # back off without blocking other tasklets on this thread
+            ttl = None
+            yield ndb.sleep(wait)
+            wait = wait + i
+    raise ndb.Return(({}, ttl))